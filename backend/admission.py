@@ -0,0 +1,146 @@
+"""
+Event-loop lag monitoring and admission control.
+
+Large dossier bodies and catalog filtering run on the event loop, so
+overload shows up as the loop falling behind. LoopLagMonitor measures how
+late a periodic timer fires and reports lag only while it stays high;
+AdmissionMiddleware turns away
+low-priority requests with 503 and Retry-After while the lag or the number
+of requests in flight is above its limit, and normal ones too once the lag
+passes a second, severe threshold. Critical requests are always admitted,
+so the service degrades instead of collapsing.
+"""
+import asyncio
+import json
+import time
+from collections import deque
+from typing import Callable, Optional
+
+import metrics
+from ratelimit import retry_after_header
+
+CRITICAL = "critical"
+NORMAL = "normal"
+LOW = "low"
+
+LOOP_LAG_SECONDS = metrics.gauge(
+    "event_loop_lag_seconds", "Delay of the event loop behind its timers, sustained over recent probes"
+)
+LOOP_LAG_SAMPLES = metrics.histogram(
+    "event_loop_lag_sample_seconds", "How late each event-loop lag probe fired",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+SHED_TOTAL = metrics.counter(
+    "admission_shed_total", "Requests rejected by admission control", ["priority", "reason"]
+)
+
+
+class LoopLagMonitor:
+    """Probe the event loop every interval and track how late it runs.
+
+    The lag is the smallest delay among the last `sustain` probes, so it is
+    high only when the loop stays behind. One slow request, which delays a
+    single probe, does not shed anything.
+    """
+
+    def __init__(self, interval_seconds: float = 0.05, sustain: int = 3):
+        self.interval_seconds = interval_seconds
+        self.samples: deque = deque(maxlen=max(1, sustain))
+        self.lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.interval_seconds > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.samples.clear()
+        self.lag = 0.0
+
+    def record(self, sample: float):
+        self.samples.append(sample)
+        self.lag = min(self.samples) if len(self.samples) == self.samples.maxlen else 0.0
+        LOOP_LAG_SECONDS.set(self.lag)
+        LOOP_LAG_SAMPLES.observe(sample)
+
+    async def _run(self):
+        while True:
+            expected = time.perf_counter() + self.interval_seconds
+            await asyncio.sleep(self.interval_seconds)
+            self.record(max(0.0, time.perf_counter() - expected))
+
+
+class AdmissionMiddleware:
+    """ASGI middleware shedding low-priority requests while the server is overloaded.
+
+    classify(scope) returns CRITICAL, NORMAL or LOW; it is only consulted
+    while the server is overloaded, so it adds nothing to the normal path.
+    """
+
+    def __init__(
+        self,
+        app,
+        monitor: LoopLagMonitor,
+        classify: Callable[[dict], str],
+        lag_threshold_seconds: float,
+        severe_lag_seconds: float = 0.0,
+        max_in_flight: int = 0,
+        retry_after_seconds: float = 2.0
+    ):
+        self.app = app
+        self.monitor = monitor
+        self.classify = classify
+        self.lag_threshold_seconds = lag_threshold_seconds
+        self.severe_lag_seconds = severe_lag_seconds
+        self.max_in_flight = max_in_flight
+        self.retry_after_seconds = retry_after_seconds
+        self.in_flight = 0
+
+    def overload_reason(self) -> Optional[str]:
+        if self.lag_threshold_seconds > 0 and self.monitor.lag > self.lag_threshold_seconds:
+            return "loop_lag"
+        if self.max_in_flight > 0 and self.in_flight >= self.max_in_flight:
+            return "in_flight"
+        return None
+
+    def severe(self) -> bool:
+        return self.severe_lag_seconds > 0 and self.monitor.lag > self.severe_lag_seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        reason = self.overload_reason()
+        if reason:
+            priority = self.classify(scope)
+            if priority == LOW or (priority == NORMAL and self.severe()):
+                SHED_TOTAL.inc(priority=priority, reason=reason)
+                await self._reject(send)
+                return
+
+        self.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
+
+    async def _reject(self, send):
+        body = json.dumps({"detail": "Server is busy, please retry shortly"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", retry_after_header(self.retry_after_seconds).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
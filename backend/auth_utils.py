@@ -1,21 +1,36 @@
 import os
 import jwt
 from datetime import datetime, timedelta, timezone
-from passlib.context import CryptContext
 from typing import Optional
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+import metrics
+
+PASSWORD_HASH_SECONDS = metrics.histogram(
+    "password_hash_duration_seconds", "Time spent in bcrypt hashing and verification", ["operation"]
+)
+
+_pwd_context = None
 JWT_SECRET = os.environ.get('JWT_SECRET', 'your-secret-key')
 JWT_ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_HOURS = 24
 
+def get_pwd_context():
+    """Build the passlib context on first use; it loads the bcrypt backend"""
+    global _pwd_context
+    if _pwd_context is None:
+        from passlib.context import CryptContext
+        _pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    return _pwd_context
+
 def hash_password(password: str) -> str:
     """Hash a password"""
-    return pwd_context.hash(password)
+    with PASSWORD_HASH_SECONDS.time(operation="hash"):
+        return get_pwd_context().hash(password)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against a hash"""
-    return pwd_context.verify(plain_password, hashed_password)
+    with PASSWORD_HASH_SECONDS.time(operation="verify"):
+        return get_pwd_context().verify(plain_password, hashed_password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Create a JWT access token"""
@@ -0,0 +1,156 @@
+"""
+Streaming NDJSON export and import.
+
+Exports walk a Motor cursor batch by batch and yield encoded lines in
+chunks, so memory stays constant however large the collection is. Imports
+read the request body line by line, validate each line, and write every
+IMPORT_BATCH_SIZE valid documents with one bulk_write. Errors are reported
+per line.
+"""
+import json
+from datetime import date, datetime
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+
+from pydantic import BaseModel, ValidationError
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+EXPORT_BATCH_SIZE = 500
+CHUNK_BYTES = 64 * 1024
+MAX_LINE_BYTES = 1024 * 1024
+MAX_REPORTED_ERRORS = 1000
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def encode_line(document: dict) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(document, default=str, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(document, ensure_ascii=False, default=_default) + "\n").encode("utf-8")
+
+
+async def export_lines(cursor) -> AsyncIterator[bytes]:
+    """Encode a cursor as NDJSON, yielding roughly CHUNK_BYTES at a time"""
+    buffer = bytearray()
+    async for document in cursor.batch_size(EXPORT_BATCH_SIZE):
+        buffer += encode_line(document)
+        if len(buffer) >= CHUNK_BYTES:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+class LineTooLong(ValueError):
+    def __init__(self, line_number: int):
+        super().__init__(f"Line exceeds {MAX_LINE_BYTES} bytes")
+        self.line_number = line_number
+
+
+async def read_lines(stream: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, bytes]]:
+    """(line number, line) pairs from a byte stream, blank lines skipped"""
+    pending = b""
+    line_number = 0
+    async for chunk in stream:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                yield line_number, line
+        if len(pending) > MAX_LINE_BYTES:
+            raise LineTooLong(line_number + 1)
+    if pending.strip():
+        yield line_number + 1, pending
+
+
+def describe_validation_error(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in detail['loc']) or 'line'}: {detail['msg']}"
+        for detail in error.errors()
+    )
+
+
+class ImportReport:
+    """Counts and per-line errors of one import"""
+
+    def __init__(self):
+        self.received = 0
+        self.written = 0
+        self.error_count = 0
+        self.errors: List[dict] = []
+        self.stopped_at_line: Optional[int] = None
+
+    def error(self, line: int, message: str):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "error": message})
+
+    def as_dict(self) -> dict:
+        return {
+            "received": self.received,
+            "written": self.written,
+            "error_count": self.error_count,
+            "errors": sorted(self.errors, key=lambda error: error["line"]),
+            "stopped_at_line": self.stopped_at_line,
+        }
+
+
+async def import_lines(
+    stream: AsyncIterator[bytes],
+    model: type,
+    write_batch: Callable,
+    ordered: bool,
+    batch_size: int
+) -> ImportReport:
+    """Validate NDJSON lines against model and hand them to write_batch in batches.
+
+    write_batch(batch) receives a list of (line number, model instance) and
+    returns the number of documents written and a list of (line number,
+    error message) for the writes that failed. With ordered=True the import
+    stops at the first invalid or failed line.
+    """
+    report = ImportReport()
+    batch: List[Tuple[int, BaseModel]] = []
+
+    async def flush() -> bool:
+        written, failures = await write_batch(batch)
+        report.written += written
+        for line, message in failures:
+            report.error(line, message)
+        batch.clear()
+        if failures and ordered:
+            report.stopped_at_line = failures[0][0]
+            return False
+        return True
+
+    try:
+        async for line_number, line in read_lines(stream):
+            report.received += 1
+            try:
+                batch.append((line_number, model.model_validate_json(line)))
+            except ValidationError as e:
+                report.error(line_number, describe_validation_error(e))
+                if ordered:
+                    # Lines before the bad one are still written, in order
+                    if batch and not await flush():
+                        return report
+                    report.stopped_at_line = line_number
+                    return report
+                continue
+            if len(batch) >= batch_size and not await flush():
+                return report
+    except LineTooLong as e:
+        report.error(e.line_number, str(e))
+        report.stopped_at_line = e.line_number
+
+    if batch:
+        await flush()
+    return report
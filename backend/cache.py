@@ -0,0 +1,49 @@
+"""
+Small in-process caches for hot read paths
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Iterable
+
+MISSING = object()
+
+
+class TTLCache:
+    """LRU cache whose entries expire a fixed number of seconds after being set"""
+
+    def __init__(self, name: str, ttl_seconds: float, maxsize: int = 10000):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any):
+        self._data[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> bool:
+        return self._data.pop(key, None) is not None
+
+    def invalidate_many(self, keys: Iterable[Hashable]) -> int:
+        return sum(1 for key in keys if self._data.pop(key, None) is not None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -0,0 +1,169 @@
+"""
+Catalog versioning for delta sync.
+
+Every write to scp_objects takes the next value of the `catalog` counter
+and stamps it on the document as `version` together with `updated_at`.
+Deletes leave a tombstone in `scp_tombstones` carrying the deleting
+version. A client that remembers the highest version it has seen asks for
+everything newer and receives only the changed and deleted objects.
+
+Versions are allocated before the write commits, so two writes racing each
+other can commit out of order. Every allocation is therefore listed as
+pending on the counter until its write finishes, and changes_since never
+reports a version at or past the lowest pending one; a client syncing
+between the two commits picks the slower write up on its next sync.
+
+Objects and tombstones also carry `clearance_history`, the clearance the
+object required from each version on. A client is told an object it can
+no longer see was deleted only if it could see it at the version it last
+synced, so classified numbers never reach clients that never had them.
+"""
+import time
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import AsyncIterator, List, Optional, Tuple
+
+from models import get_required_clearance
+
+COUNTER_ID = "catalog"
+# A write pending for longer than this has failed without releasing its versions
+PENDING_TIMEOUT_SECONDS = 60.0
+
+
+async def ensure_indexes(db):
+    await db.scp_objects.create_index("version")
+    await db.scp_tombstones.create_index("number", unique=True)
+    await db.scp_tombstones.create_index("version")
+
+
+@asynccontextmanager
+async def reserve(db, count: int = 1) -> AsyncIterator[int]:
+    """Reserve count consecutive versions for a write made inside the block; yields the first"""
+    from pymongo import ReturnDocument
+
+    token = uuid.uuid4().hex
+    # The pending entry is pushed with the increment, so no reader sees one without the other
+    counter = await db.counters.find_one_and_update(
+        {"_id": COUNTER_ID},
+        {"$inc": {"value": count}, "$push": {"pending": {"token": token, "at": time.time()}}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    first = counter["value"] - count + 1
+    try:
+        await db.counters.update_one(
+            {"_id": COUNTER_ID, "pending.token": token},
+            {"$set": {"pending.$.first": first}}
+        )
+        yield first
+    finally:
+        await db.counters.update_one({"_id": COUNTER_ID}, {"$pull": {"pending": {"token": token}}})
+        await db.counters.update_one(
+            {"_id": COUNTER_ID},
+            {"$pull": {"pending": {"at": {"$lt": time.time() - PENDING_TIMEOUT_SECONDS}}}}
+        )
+
+
+@asynccontextmanager
+async def stamp(db) -> AsyncIterator[dict]:
+    """Fields to $set on a document being created or changed inside the block"""
+    async with reserve(db) as version:
+        yield {"version": version, "updated_at": datetime.now(timezone.utc)}
+
+
+def clearance_entry(version: int, threat_class: str) -> dict:
+    """A clearance_history entry: from version on, the object needs this level"""
+    return {"version": version, "level": get_required_clearance(threat_class)}
+
+
+def clearance_at(history: List[dict], version: int) -> Optional[int]:
+    """Clearance an object required at a version; None if it did not exist yet"""
+    level = None
+    for entry in history:
+        if entry["version"] > version:
+            break
+        level = entry["level"]
+    return level
+
+
+def was_visible(doc: dict, since: int, clearance_level: int) -> bool:
+    """Whether a client synced to version since could see the object"""
+    history = doc.get("clearance_history")
+    if history is None:
+        # Deleted before histories were kept; only a synced client can have it
+        return since > 0
+    level = clearance_at(history, since)
+    return level is not None and level <= clearance_level
+
+
+async def backfill(db) -> int:
+    """Give documents written before versioning a version of their own"""
+    if not await db.scp_objects.find_one({"version": {"$exists": False}}, {"_id": 1}):
+        return 0
+    async with stamp(db) as fields:
+        result = await db.scp_objects.update_many({"version": {"$exists": False}}, {"$set": fields})
+    return result.modified_count
+
+
+async def backfill_clearance(db) -> int:
+    """Start the clearance history of objects written before it was kept"""
+    count = 0
+    async for obj in db.scp_objects.find(
+        {"clearance_history": {"$exists": False}},
+        {"_id": 0, "number": 1, "version": 1, "threat_class": 1}
+    ):
+        entry = clearance_entry(obj.get("version", 0), obj.get("threat_class", ""))
+        await db.scp_objects.update_one({"number": obj["number"]}, {"$set": {"clearance_history": [entry]}})
+        count += 1
+    return count
+
+
+async def record_delete(db, deleted: dict):
+    """Leave a tombstone so synced clients drop the deleted object"""
+    async with stamp(db) as fields:
+        await db.scp_tombstones.update_one(
+            {"number": deleted["number"]},
+            {"$set": {
+                "number": deleted["number"],
+                "clearance_history": deleted.get("clearance_history", []),
+                **fields,
+                "deleted_at": datetime.now(timezone.utc)
+            }},
+            upsert=True
+        )
+
+
+async def clear_tombstone(db, number: str):
+    """A number that is created again is no longer deleted"""
+    await db.scp_tombstones.delete_one({"number": number})
+
+
+async def clear_tombstones(db, numbers: List[str]):
+    await db.scp_tombstones.delete_many({"number": {"$in": numbers}})
+
+
+async def settled_version(db, since: int) -> int:
+    """The highest version below every write still in flight"""
+    counter = await db.counters.find_one({"_id": COUNTER_ID})
+    if not counter:
+        return 0
+    cutoff = time.time() - PENDING_TIMEOUT_SECONDS
+    firsts = [entry.get("first") for entry in counter.get("pending", []) if entry["at"] >= cutoff]
+    if None in firsts:
+        # Allocated a moment ago and not yet labelled; its version is unknown
+        return min(counter["value"], since)
+    return min([counter["value"]] + [first - 1 for first in firsts])
+
+
+async def changes_since(db, since: int) -> Tuple[int, List[dict], List[dict]]:
+    """(settled version, objects changed after since, tombstones of objects deleted after since)"""
+    version = await settled_version(db, since)
+    if since >= version:
+        return version, [], []
+    window = {"version": {"$gt": since, "$lte": version}}
+    changed = await db.scp_objects.find(window, {"_id": 0}).sort("version", 1).to_list(None)
+    tombstones = await db.scp_tombstones.find(window, {"_id": 0, "number": 1, "clearance_history": 1}).to_list(None)
+    present = {obj["number"] for obj in changed}
+    deleted = [tombstone for tombstone in tombstones if tombstone["number"] not in present]
+    return version, changed, deleted
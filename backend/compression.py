@@ -0,0 +1,182 @@
+"""
+Negotiated response compression and JSON encoding.
+
+CompressionMiddleware compresses responses whose body reaches a size
+threshold with the best encoding the client accepts: brotli, or gzip if
+the `brotli` package from requirements.txt is missing. Responses that
+already carry a Content-Encoding (such as precompressed catalog payloads)
+pass through untouched.
+"""
+import gzip
+import zlib
+from typing import Dict, Optional
+
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import Response
+
+import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import orjson  # noqa: F401
+    from fastapi.responses import ORJSONResponse as DefaultJSONResponse
+except ImportError:
+    DefaultJSONResponse = JSONResponse
+
+COMPRESSED_BYTES_TOTAL = metrics.counter(
+    "http_response_compressed_bytes_total", "Response bytes before and after compression", ["encoding", "stage"]
+)
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+# Event streams must reach the client as they are produced
+STREAMING_TYPES = ("text/event-stream",)
+
+SUPPORTED_ENCODINGS = ("br", "gzip") if brotli else ("gzip",)
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """Pick the preferred supported encoding from an Accept-Encoding header"""
+    weights = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            weights[name] = quality
+    best, best_quality = None, 0.0
+    for encoding in SUPPORTED_ENCODINGS:
+        quality = weights.get(encoding, weights.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(body: bytes, encoding: str, gzip_level: int = 6, brotli_quality: int = 5) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=brotli_quality)
+    return gzip.compress(body, compresslevel=gzip_level, mtime=0)
+
+
+class _StreamCompressor:
+    """Incremental compressor for streaming responses"""
+
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=brotli_quality)
+            self._compress = self._compressor.process
+            self._flush = self._compressor.finish
+        else:
+            self._compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+            self._compress = self._compressor.compress
+            self._flush = self._compressor.flush
+
+    def compress(self, chunk: bytes) -> bytes:
+        return self._compress(chunk)
+
+    def finish(self) -> bytes:
+        return self._flush()
+
+
+class PrecompressedPayload:
+    """A JSON body encoded once and compressed ahead of time for every supported encoding"""
+
+    def __init__(self, body: bytes, gzip_level: int = 9, brotli_quality: int = 11):
+        self.variants: Dict[Optional[str], bytes] = {None: body}
+        for encoding in SUPPORTED_ENCODINGS:
+            self.variants[encoding] = compress(body, encoding, gzip_level, brotli_quality)
+
+    def response(self, accept_encoding: str) -> Response:
+        encoding = negotiate(accept_encoding)
+        headers = {"Vary": "Accept-Encoding"}
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(self.variants[encoding], media_type="application/json", headers=headers)
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing large responses with the negotiated encoding"""
+
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 5):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        state = {"start": None, "compressor": None, "passthrough": False}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                content_type = headers.get("content-type", "")
+                if (
+                    "content-encoding" in headers
+                    or not content_type.startswith(COMPRESSIBLE_TYPES)
+                    or content_type.startswith(STREAMING_TYPES)
+                ):
+                    state["passthrough"] = True
+                    await send(message)
+                else:
+                    # Wait for the first body chunk to decide
+                    state["start"] = message
+                return
+
+            if message["type"] != "http.response.body" or state["passthrough"]:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            start = state["start"]
+
+            if start is not None:
+                state["start"] = None
+                if not more_body and len(body) < self.minimum_size:
+                    state["passthrough"] = True
+                    await send(start)
+                    await send(message)
+                    return
+                headers = MutableHeaders(raw=start["headers"])
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if more_body:
+                    del headers["Content-Length"]
+                    state["compressor"] = _StreamCompressor(encoding, self.gzip_level, self.brotli_quality)
+                else:
+                    compressed = compress(body, encoding, self.gzip_level, self.brotli_quality)
+                    COMPRESSED_BYTES_TOTAL.inc(len(body), encoding=encoding, stage="identity")
+                    COMPRESSED_BYTES_TOTAL.inc(len(compressed), encoding=encoding, stage="compressed")
+                    headers["Content-Length"] = str(len(compressed))
+                    await send(start)
+                    await send({"type": "http.response.body", "body": compressed})
+                    return
+                await send(start)
+
+            compressor = state["compressor"]
+            chunk = compressor.compress(body)
+            if not more_body:
+                chunk += compressor.finish()
+            COMPRESSED_BYTES_TOTAL.inc(len(body), encoding=encoding, stage="identity")
+            COMPRESSED_BYTES_TOTAL.inc(len(chunk), encoding=encoding, stage="compressed")
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
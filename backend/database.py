@@ -0,0 +1,85 @@
+"""
+MongoDB client configuration.
+
+Pool sizing, timeouts, compression and the read preference for read-mostly
+queries are taken from the environment:
+
+    MONGO_MAX_POOL_SIZE                 max connections per server (default 100)
+    MONGO_MIN_POOL_SIZE                 connections kept open when idle (default 0)
+    MONGO_MAX_IDLE_TIME_MS              close connections idle for longer than this
+    MONGO_WAIT_QUEUE_TIMEOUT_MS         fail a checkout that waits longer than this
+    MONGO_SERVER_SELECTION_TIMEOUT_MS   fail fast when no server is reachable (default 5000)
+    MONGO_CONNECT_TIMEOUT_MS            TCP connect timeout
+    MONGO_SOCKET_TIMEOUT_MS             per-operation socket timeout
+    MONGO_COMPRESSORS                   e.g. "zstd,snappy,zlib"
+    MONGO_READ_PREFERENCE               read preference for bulk exports
+                                        (primary, primaryPreferred, secondary,
+                                        secondaryPreferred, nearest; default primary)
+    MONGO_READ_MAX_STALENESS_S          max replication lag tolerated on secondaries
+"""
+import os
+from typing import Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import read_preferences
+
+from db_metrics import CommandTimer, PoolMonitor
+
+INT_OPTIONS = {
+    "maxPoolSize": "MONGO_MAX_POOL_SIZE",
+    "minPoolSize": "MONGO_MIN_POOL_SIZE",
+    "maxIdleTimeMS": "MONGO_MAX_IDLE_TIME_MS",
+    "waitQueueTimeoutMS": "MONGO_WAIT_QUEUE_TIMEOUT_MS",
+    "serverSelectionTimeoutMS": "MONGO_SERVER_SELECTION_TIMEOUT_MS",
+    "connectTimeoutMS": "MONGO_CONNECT_TIMEOUT_MS",
+    "socketTimeoutMS": "MONGO_SOCKET_TIMEOUT_MS",
+}
+
+DEFAULT_OPTIONS = {
+    "maxPoolSize": 100,
+    "serverSelectionTimeoutMS": 5000,
+}
+
+READ_PREFERENCES = {
+    "primary": read_preferences.Primary,
+    "primaryPreferred": read_preferences.PrimaryPreferred,
+    "secondary": read_preferences.Secondary,
+    "secondaryPreferred": read_preferences.SecondaryPreferred,
+    "nearest": read_preferences.Nearest,
+}
+
+def client_options() -> dict:
+    """Collect driver options from the environment"""
+    options = dict(DEFAULT_OPTIONS)
+    for option, env_name in INT_OPTIONS.items():
+        value = os.environ.get(env_name)
+        if value:
+            options[option] = int(value)
+    compressors = os.environ.get('MONGO_COMPRESSORS')
+    if compressors:
+        options["compressors"] = compressors
+    return options
+
+def read_mostly_preference():
+    """Read preference for bulk reads that tolerate replication lag"""
+    name = os.environ.get('MONGO_READ_PREFERENCE', 'primary')
+    if name not in READ_PREFERENCES:
+        raise ValueError(f"Unknown MONGO_READ_PREFERENCE: {name}")
+    if name == "primary":
+        return read_preferences.Primary()
+    staleness = os.environ.get('MONGO_READ_MAX_STALENESS_S')
+    return READ_PREFERENCES[name](max_staleness=int(staleness) if staleness else -1)
+
+def create_client(mongo_url: str, options: Optional[dict] = None) -> AsyncIOMotorClient:
+    """Create the Motor client with pool settings and monitoring listeners"""
+    return AsyncIOMotorClient(
+        mongo_url,
+        # tz_aware so stored BSON datetimes come back as UTC-aware values
+        tz_aware=True,
+        event_listeners=[CommandTimer(), PoolMonitor()],
+        **(options if options is not None else client_options())
+    )
+
+def read_mostly_database(client: AsyncIOMotorClient, name: str):
+    """Database handle for queries that may be served by secondaries"""
+    return client.get_database(name, read_preference=read_mostly_preference())
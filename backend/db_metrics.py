@@ -0,0 +1,120 @@
+"""
+MongoDB driver monitoring listeners feeding the metrics registry
+"""
+import threading
+import time
+
+from pymongo import monitoring
+
+import metrics
+import profiling
+
+DB_COMMAND_SECONDS = metrics.histogram(
+    "mongo_command_duration_seconds", "MongoDB command latency", ["command", "collection"]
+)
+DB_COMMAND_FAILURES = metrics.counter(
+    "mongo_command_failures_total", "MongoDB commands that returned an error", ["command", "collection"]
+)
+
+
+class CommandTimer(monitoring.CommandListener):
+    """Time every command sent by the driver"""
+
+    def __init__(self):
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            # getMore carries the collection separately from the cursor id
+            collection = event.command.get("collection", "")
+        with self._lock:
+            self._collections[event.request_id] = collection
+
+    def _finish(self, event) -> str:
+        with self._lock:
+            return self._collections.pop(event.request_id, "")
+
+    def succeeded(self, event):
+        collection = self._finish(event)
+        duration = event.duration_micros / 1e6
+        DB_COMMAND_SECONDS.observe(duration, command=event.command_name, collection=collection)
+        profiling.record_query(event.command_name, collection, duration)
+
+    def failed(self, event):
+        collection = self._finish(event)
+        duration = event.duration_micros / 1e6
+        DB_COMMAND_SECONDS.observe(duration, command=event.command_name, collection=collection)
+        DB_COMMAND_FAILURES.inc(command=event.command_name, collection=collection)
+        profiling.record_query(event.command_name, collection, duration, failed=True)
+
+
+POOL_CHECKOUT_WAIT_SECONDS = metrics.histogram(
+    "mongo_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection", ["outcome"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+)
+POOL_CONNECTIONS = metrics.gauge(
+    "mongo_pool_connections", "Open pooled connections per server", ["address"]
+)
+POOL_CONNECTIONS_IN_USE = metrics.gauge(
+    "mongo_pool_connections_in_use", "Pooled connections checked out per server", ["address"]
+)
+POOL_CHECKOUT_FAILURES = metrics.counter(
+    "mongo_pool_checkout_failures_total", "Connection checkouts that failed, by reason", ["reason"]
+)
+POOL_CLEARED = metrics.counter("mongo_pool_cleared_total", "Times a connection pool was cleared", ["address"])
+
+
+def _address(event) -> str:
+    host, port = event.address
+    return f"{host}:{port}"
+
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """Track pool size, utilisation and checkout wait time"""
+
+    def __init__(self):
+        # Checkouts run synchronously on the calling executor thread
+        self._local = threading.local()
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        POOL_CLEARED.inc(address=_address(event))
+
+    def pool_closed(self, event):
+        POOL_CONNECTIONS.set(0, address=_address(event))
+        POOL_CONNECTIONS_IN_USE.set(0, address=_address(event))
+
+    def connection_created(self, event):
+        POOL_CONNECTIONS.inc(address=_address(event))
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        POOL_CONNECTIONS.dec(address=_address(event))
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def _waited(self) -> float:
+        started = getattr(self._local, "started", None)
+        self._local.started = None
+        return time.perf_counter() - started if started is not None else 0.0
+
+    def connection_check_out_failed(self, event):
+        POOL_CHECKOUT_WAIT_SECONDS.observe(self._waited(), outcome="failed")
+        POOL_CHECKOUT_FAILURES.inc(reason=str(event.reason))
+
+    def connection_checked_out(self, event):
+        POOL_CHECKOUT_WAIT_SECONDS.observe(self._waited(), outcome="success")
+        POOL_CONNECTIONS_IN_USE.inc(address=_address(event))
+
+    def connection_checked_in(self, event):
+        POOL_CONNECTIONS_IN_USE.dec(address=_address(event))
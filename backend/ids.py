@@ -0,0 +1,43 @@
+"""
+Time-ordered unique identifiers (ULID)
+"""
+import os
+import threading
+import time
+
+CROCKFORD_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+
+_lock = threading.Lock()
+_last_ms = -1
+_last_random = 0
+
+def _encode(value: int) -> str:
+    """Encode a 128-bit integer as 26 Crockford base32 characters"""
+    chars = []
+    for _ in range(26):
+        chars.append(CROCKFORD_ALPHABET[value & 0x1F])
+        value >>= 5
+    return "".join(reversed(chars))
+
+def new_ulid() -> str:
+    """Generate a ULID: 48-bit millisecond timestamp followed by 80 random bits.
+
+    Within one process, ids generated in the same millisecond increment the
+    random part, so they sort in creation order. Across workers, uniqueness
+    comes from the random part and no coordination is needed.
+    """
+    global _last_ms, _last_random
+    with _lock:
+        now_ms = time.time_ns() // 1_000_000
+        if now_ms <= _last_ms:
+            # Same millisecond or clock moved backwards: stay monotonic
+            now_ms = _last_ms
+            _last_random += 1
+            if _last_random >= 1 << 80:
+                now_ms += 1
+                _last_random = int.from_bytes(os.urandom(10), "big")
+        else:
+            _last_random = int.from_bytes(os.urandom(10), "big")
+        _last_ms = now_ms
+        value = (now_ms << 80) | _last_random
+    return _encode(value)
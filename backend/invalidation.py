@@ -0,0 +1,84 @@
+"""
+Cross-worker cache invalidation over the pub/sub hub.
+
+Every worker registers its caches with an InvalidationBus. Invalidating
+through the bus applies the change locally at once and broadcasts it, and
+each other worker applies it when the message arrives. TTLs still bound
+staleness if a message is lost while a worker reconnects.
+"""
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from typing import Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "cache-invalidation"
+
+
+class InvalidationBus:
+    """Apply cache invalidations in this worker and broadcast them to the others"""
+
+    def __init__(self, pubsub):
+        self.pubsub = pubsub
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.received = 0
+        self._caches: Dict[str, object] = {}
+        self._handlers = []
+        self._subscription = None
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, cache):
+        """Track a cache.TTLCache by its name"""
+        self._caches[cache.name] = cache
+        return cache
+
+    def on_invalidate(self, handler):
+        """Call handler(cache_name, keys) for every invalidation, local or remote"""
+        self._handlers.append(handler)
+        return handler
+
+    def start(self):
+        self._subscription = self.pubsub.subscribe(CHANNEL)
+        self._task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._subscription:
+            self._subscription.close()
+            self._subscription = None
+
+    async def invalidate(self, cache_name: str, keys: Optional[Iterable] = None):
+        """Drop keys from a cache everywhere; keys=None clears the whole cache"""
+        keys = list(keys) if keys is not None else None
+        self._apply(cache_name, keys)
+        await self.pubsub.publish(CHANNEL, {"origin": self.worker_id, "cache": cache_name, "keys": keys})
+
+    def _apply(self, cache_name: str, keys: Optional[list]):
+        cache = self._caches.get(cache_name)
+        if cache is not None:
+            if keys is None:
+                cache.clear()
+            else:
+                cache.invalidate_many(keys)
+        for handler in self._handlers:
+            try:
+                handler(cache_name, keys)
+            except Exception as e:
+                logger.error(f"Invalidation handler failed for {cache_name}: {e}")
+
+    async def _listen(self):
+        while True:
+            message = await self._subscription.get()
+            if message.get("origin") == self.worker_id:
+                continue
+            self.received += 1
+            self._apply(message["cache"], message.get("keys"))
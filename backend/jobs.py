@@ -0,0 +1,149 @@
+"""
+In-process background jobs for work that can finish after the response.
+
+Each named queue is bounded and served by its own worker tasks. A failing
+job is retried with exponential backoff up to the queue's attempt limit.
+When a queue is full, or the runner is not running, the job runs inline
+in the caller instead, so side effects are delayed but never lost. On
+shutdown the runner stops taking jobs and drains what is queued before
+the database connection closes.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+JOBS_TOTAL = metrics.counter(
+    "jobs_total", "Background jobs by queue and outcome", ["queue", "outcome"]
+)
+JOB_SECONDS = metrics.histogram(
+    "job_duration_seconds", "Time spent running background jobs, retries included", ["queue"]
+)
+JOB_QUEUE_WAIT_SECONDS = metrics.histogram(
+    "job_queue_wait_seconds", "Time jobs spend queued before a worker picks them up", ["queue"],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+)
+
+Job = Callable[..., Awaitable[Any]]
+
+
+class JobQueue:
+    """A bounded queue of jobs and the workers serving it"""
+
+    def __init__(self, name: str, maxsize: int = 1000, workers: int = 2, max_attempts: int = 3, retry_delay: float = 0.5):
+        self.name = name
+        self.maxsize = maxsize
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def __len__(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self):
+        self._queue = asyncio.Queue(self.maxsize)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    def offer(self, job: Job, args: tuple, kwargs: dict) -> bool:
+        """Queue a job; False if the queue is full or not running"""
+        if not self.running:
+            return False
+        try:
+            self._queue.put_nowait((time.perf_counter(), job, args, kwargs))
+        except asyncio.QueueFull:
+            return False
+        JOBS_TOTAL.inc(queue=self.name, outcome="queued")
+        return True
+
+    async def run(self, job: Job, args: tuple, kwargs: dict) -> bool:
+        """Run a job with retries; True if it eventually succeeded"""
+        start = time.perf_counter()
+        try:
+            for attempt in range(1, self.max_attempts + 1):
+                try:
+                    await job(*args, **kwargs)
+                    JOBS_TOTAL.inc(queue=self.name, outcome="succeeded")
+                    return True
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    if attempt == self.max_attempts:
+                        JOBS_TOTAL.inc(queue=self.name, outcome="failed")
+                        logger.error(f"Job {getattr(job, '__name__', job)} on {self.name} failed after {attempt} attempts: {e}")
+                        return False
+                    JOBS_TOTAL.inc(queue=self.name, outcome="retried")
+                    await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+        finally:
+            JOB_SECONDS.observe(time.perf_counter() - start, queue=self.name)
+
+    async def drain(self, timeout: float):
+        """Finish queued jobs within timeout, then stop the workers"""
+        if not self.running:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Abandoning {len(self)} queued jobs on {self.name} after {timeout}s drain")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _work(self):
+        while True:
+            queued_at, job, args, kwargs = await self._queue.get()
+            JOB_QUEUE_WAIT_SECONDS.observe(time.perf_counter() - queued_at, queue=self.name)
+            try:
+                await self.run(job, args, kwargs)
+            finally:
+                self._queue.task_done()
+
+
+class JobRunner:
+    """Named job queues started and drained with the application"""
+
+    def __init__(self, drain_timeout: float = 10.0):
+        self.drain_timeout = drain_timeout
+        self.queues: Dict[str, JobQueue] = {}
+        self._accepting = False
+
+    def add_queue(self, name: str, **options) -> JobQueue:
+        queue = self.queues[name] = JobQueue(name, **options)
+        return queue
+
+    def start(self):
+        for queue in self.queues.values():
+            queue.start()
+        self._accepting = True
+
+    async def submit(self, queue_name: str, job: Job, *args, **kwargs):
+        """Run job(*args, **kwargs) in the background, or now if that is not possible"""
+        queue = self.queues[queue_name]
+        if self._accepting and queue.offer(job, args, kwargs):
+            return
+        JOBS_TOTAL.inc(queue=queue_name, outcome="inline")
+        await queue.run(job, args, kwargs)
+
+    async def drain(self):
+        """Stop taking jobs and finish the queued ones"""
+        self._accepting = False
+        await asyncio.gather(*(queue.drain(self.drain_timeout) for queue in self.queues.values()))
+
+
+def track_jobs(runner: JobRunner) -> JobRunner:
+    """Export the depth of every queue of a runner"""
+    metrics.REGISTRY.register(metrics.GaugeFunc(
+        "job_queue_depth", "Jobs waiting in each background queue", ["queue"],
+        lambda: {(name,): len(queue) for name, queue in runner.queues.items()}
+    ))
+    return runner
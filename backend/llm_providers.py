@@ -0,0 +1,204 @@
+"""
+Pluggable LLM providers for MAL0 chat.
+
+The provider is chosen with LLM_PROVIDER:
+    emergent  - Emergent integrations gateway (default, needs EMERGENT_LLM_KEY)
+    stub      - local synthetic responses with configurable latency and errors
+    record    - emergent, and append every exchange to LLM_RECORDINGS_PATH
+    replay    - stub that answers from LLM_RECORDINGS_PATH
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STUB_RESPONSES = [
+    "Приветствую. Я MAL0, ассистент базы данных Eternal Sentinels. Чем могу помочь?",
+    "Интересный вопрос. В базе данных есть информация об этом объекте, но часть её засекречена.",
+    "Я рада помочь. Уточните, пожалуйста, номер объекта, который вас интересует.",
+    "Для доступа к этой информации требуется более высокий уровень допуска.",
+]
+
+
+class LLMProvider:
+    """Base class: subclasses implement complete() and may override stream()"""
+
+    name = "base"
+    model = ""
+
+    def is_available(self) -> bool:
+        return True
+
+    async def complete(self, session_id: str, system_message: str, text: str) -> str:
+        raise NotImplementedError
+
+    async def stream(self, session_id: str, system_message: str, text: str) -> AsyncIterator[str]:
+        """Yield the response in chunks; providers without streaming yield it whole"""
+        yield await self.complete(session_id, system_message, text)
+
+
+class EmergentProvider(LLMProvider):
+    """Completions through emergentintegrations, imported on first use.
+
+    LlmChat only returns whole completions, so stream() yields the reply as
+    one chunk after the full model latency; /api/chat/ws streams tokens only
+    with providers that produce them.
+    """
+
+    name = "openai"
+
+    def __init__(self, api_key: Optional[str], model: str = "gpt-4o-mini"):
+        self.api_key = api_key
+        self.model = model
+
+    def is_available(self) -> bool:
+        return bool(self.api_key)
+
+    async def complete(self, session_id: str, system_message: str, text: str) -> str:
+        # Deferred: the integrations package pulls in the whole LLM SDK stack
+        from emergentintegrations.llm.chat import LlmChat, UserMessage
+
+        chat = LlmChat(
+            api_key=self.api_key,
+            session_id=session_id,
+            system_message=system_message
+        ).with_model(self.name, self.model)
+        return await chat.send_message(UserMessage(text=text))
+
+
+class StubProviderError(Exception):
+    """Injected failure; messages mirror the gateway's so fallback classification applies"""
+
+
+def recording_key(system_message: str, text: str) -> str:
+    return hashlib.sha256(f"{system_message}\0{text}".encode("utf-8")).hexdigest()
+
+
+class StubProvider(LLMProvider):
+    """Offline provider emitting recorded or synthetic responses token by token"""
+
+    name = "stub"
+    model = "stub"
+
+    def __init__(
+        self,
+        responses: Optional[List[str]] = None,
+        recordings: Optional[Dict[str, str]] = None,
+        first_token_latency: float = 0.0,
+        token_latency: float = 0.0,
+        error_rates: Optional[Dict[str, float]] = None,
+        timeout_seconds: float = 30.0,
+        seed: Optional[int] = None
+    ):
+        self.responses = responses or DEFAULT_STUB_RESPONSES
+        self.recordings = recordings or {}
+        self.first_token_latency = first_token_latency
+        self.token_latency = token_latency
+        self.error_rates = error_rates or {}
+        self.timeout_seconds = timeout_seconds
+        self.rng = random.Random(seed)
+
+    def _response_for(self, system_message: str, text: str) -> str:
+        recorded = self.recordings.get(recording_key(system_message, text))
+        if recorded is not None:
+            return recorded
+        return self.rng.choice(self.responses)
+
+    async def _maybe_fail(self):
+        roll = self.rng.random()
+        threshold = 0.0
+        for kind in ("429", "402", "timeout"):
+            threshold += self.error_rates.get(kind, 0.0)
+            if roll >= threshold:
+                continue
+            if kind == "429":
+                raise StubProviderError("429 Too Many Requests: rate limit exceeded")
+            if kind == "402":
+                raise StubProviderError("402 Payment Required: insufficient credits")
+            await asyncio.sleep(self.timeout_seconds)
+            raise asyncio.TimeoutError()
+
+    async def stream(self, session_id: str, system_message: str, text: str) -> AsyncIterator[str]:
+        await self._maybe_fail()
+        response = self._response_for(system_message, text)
+        await asyncio.sleep(self.first_token_latency)
+        words = response.split(" ")
+        for i, word in enumerate(words):
+            if i:
+                await asyncio.sleep(self.token_latency)
+            yield word if i == 0 else " " + word
+
+    async def complete(self, session_id: str, system_message: str, text: str) -> str:
+        return "".join([chunk async for chunk in self.stream(session_id, system_message, text)])
+
+
+class RecordingProvider(LLMProvider):
+    """Wrap another provider and append each exchange to a JSONL file for later replay"""
+
+    def __init__(self, inner: LLMProvider, path: Path):
+        self.inner = inner
+        self.path = path
+        self._lock = threading.Lock()
+        self.name = inner.name
+        self.model = inner.model
+
+    def is_available(self) -> bool:
+        return self.inner.is_available()
+
+    async def complete(self, session_id: str, system_message: str, text: str) -> str:
+        response = await self.inner.complete(session_id, system_message, text)
+        record = {"key": recording_key(system_message, text), "message": text, "response": response}
+        # Disk writes stay off the event loop
+        await asyncio.to_thread(self._append, json.dumps(record, ensure_ascii=False) + "\n")
+        return response
+
+    def _append(self, line: str):
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+def load_recordings(path: Path) -> Dict[str, str]:
+    recordings = {}
+    if not path.exists():
+        logger.warning(f"LLM recordings file {path} not found, replay will use synthetic responses")
+        return recordings
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                recordings[record["key"]] = record["response"]
+    return recordings
+
+
+def create_provider_from_env() -> LLMProvider:
+    """Build the provider selected by LLM_PROVIDER and its settings"""
+    provider = os.environ.get('LLM_PROVIDER', 'emergent')
+    recordings_path = Path(os.environ.get('LLM_RECORDINGS_PATH', 'llm_recordings.jsonl'))
+    emergent = EmergentProvider(os.environ.get('EMERGENT_LLM_KEY'), os.environ.get('LLM_MODEL', 'gpt-4o-mini'))
+
+    if provider == "emergent":
+        return emergent
+    if provider == "record":
+        return RecordingProvider(emergent, recordings_path)
+    if provider in ("stub", "replay"):
+        seed = os.environ.get('LLM_STUB_SEED')
+        return StubProvider(
+            recordings=load_recordings(recordings_path) if provider == "replay" else None,
+            first_token_latency=float(os.environ.get('LLM_STUB_FIRST_TOKEN_MS', '0')) / 1000,
+            token_latency=float(os.environ.get('LLM_STUB_TOKEN_MS', '0')) / 1000,
+            error_rates={
+                "429": float(os.environ.get('LLM_STUB_ERROR_429', '0')),
+                "402": float(os.environ.get('LLM_STUB_ERROR_402', '0')),
+                "timeout": float(os.environ.get('LLM_STUB_ERROR_TIMEOUT', '0')),
+            },
+            timeout_seconds=float(os.environ.get('LLM_STUB_TIMEOUT_S', '30')),
+            seed=int(seed) if seed else None
+        )
+    raise ValueError(f"Unknown LLM provider: {provider}")
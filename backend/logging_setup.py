@@ -0,0 +1,213 @@
+"""
+Non-blocking logging.
+
+Request code only puts records on a queue; a QueueListener thread formats
+them (as JSON or text) and writes them out, so stdout contention stays off
+the event loop. High-volume loggers can be sampled with per-logger rates.
+Debug records of the application's own loggers are kept in a small ring
+buffer and written out only when an error is logged, so the lead-up to a
+failure is visible without paying for debug output the rest of the time.
+Library loggers stay at the output level, so their debug calls cost
+nothing and their payloads are never held.
+"""
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from collections import deque
+from datetime import datetime, timezone
+from typing import Dict, Optional, Sequence
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    """Rates from "logger=rate,logger=rate", e.g. "server.chat=0.1" """
+    rates = {}
+    for item in spec.split(","):
+        name, _, rate = item.partition("=")
+        if name.strip() and rate.strip():
+            rates[name.strip()] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line, with `extra` fields included"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep one in every 1/rate INFO-or-lower records per sampled logger.
+
+    A rate applies to the named logger and its children. Warnings and
+    errors are never dropped.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self._resolved: Dict[str, Optional[float]] = {}
+        self._credit: Dict[str, float] = {}
+        self.dropped = 0
+
+    def _rate(self, name: str) -> Optional[float]:
+        if name not in self._resolved:
+            rate = None
+            candidate = name
+            while candidate:
+                if candidate in self.rates:
+                    rate = self.rates[candidate]
+                    break
+                candidate = candidate.rpartition(".")[0]
+            self._resolved[name] = rate
+        return self._resolved[name]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO:
+            return True
+        rate = self._rate(record.name)
+        if rate is None:
+            return True
+        credit = self._credit.get(record.name, 1.0) + rate
+        if credit >= 1.0:
+            self._credit[record.name] = credit - 1.0
+            return True
+        self._credit[record.name] = credit
+        self.dropped += 1
+        return False
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records when the queue is full instead of blocking"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Keep the traceback apart from the message so formatters can place it
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class DebugRingHandler(logging.Handler):
+    """Buffer records below the output level and flush them when an error is logged"""
+
+    def __init__(self, target: logging.Handler, output_level: int, capacity: int):
+        super().__init__(logging.DEBUG)
+        self.target = target
+        self.output_level = output_level
+        self.buffer: deque = deque(maxlen=capacity)
+
+    def emit(self, record: logging.LogRecord):
+        if record.levelno < self.output_level:
+            # Resolve the message now; its arguments may change before a dump
+            record.msg = record.getMessage()
+            record.args = None
+            self.buffer.append(record)
+        elif record.levelno >= logging.ERROR:
+            self.dump()
+
+    def dump(self):
+        while self.buffer:
+            record = self.buffer.popleft()
+            record.buffered = True
+            # Bypass the target's sampling; a dump is wanted in full
+            self.target.emit(record)
+
+
+def configure_logging(
+    level: str = "INFO",
+    fmt: str = "json",
+    sample_rates: Optional[Dict[str, float]] = None,
+    debug_buffer: int = 500,
+    debug_loggers: Sequence[str] = ("server",),
+    queue_size: int = 10000,
+    stream=None
+) -> Optional[logging.handlers.QueueListener]:
+    """Route the root logger through a queue to a background writer.
+
+    Like logging.basicConfig, does nothing if the root logger already has
+    handlers. Only debug_loggers (and their children) are lowered to DEBUG
+    for the ring buffer. Returns the listener, which is stopped at exit.
+    """
+    root = logging.getLogger()
+    if root.handlers:
+        return None
+
+    output_level = logging.getLevelName(level.upper()) if isinstance(level, str) else level
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JSONFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+
+    log_queue: queue.Queue = queue.Queue(queue_size)
+    handler = DroppingQueueHandler(log_queue)
+    handler.setLevel(output_level)
+    if sample_rates:
+        handler.addFilter(SamplingFilter(sample_rates))
+
+    root.setLevel(output_level)
+    if debug_buffer > 0 and debug_loggers:
+        # Ahead of the queue handler so the lead-up is written before the error
+        root.addHandler(DebugRingHandler(handler, output_level, debug_buffer))
+        for name in debug_loggers:
+            logging.getLogger(name).setLevel(logging.DEBUG)
+    root.addHandler(handler)
+
+    listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=False)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+def configure_from_env() -> Optional[logging.handlers.QueueListener]:
+    """configure_logging with LOG_LEVEL, LOG_FORMAT, LOG_SAMPLE, LOG_DEBUG_BUFFER,
+    LOG_DEBUG_LOGGERS and LOG_QUEUE_SIZE.
+
+    LOG_SAMPLE thins out busy loggers, e.g. "server.chat=0.1"; LOG_DEBUG_LOGGERS
+    names the comma-separated loggers whose debug records are buffered.
+    """
+    return configure_logging(
+        level=os.environ.get('LOG_LEVEL', 'INFO'),
+        fmt=os.environ.get('LOG_FORMAT', 'json'),
+        sample_rates=parse_sample_rates(os.environ.get('LOG_SAMPLE', '')),
+        debug_buffer=int(os.environ.get('LOG_DEBUG_BUFFER', '500')),
+        debug_loggers=[name.strip() for name in os.environ.get('LOG_DEBUG_LOGGERS', 'server').split(",") if name.strip()],
+        queue_size=int(os.environ.get('LOG_QUEUE_SIZE', '10000'))
+    )
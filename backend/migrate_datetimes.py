@@ -0,0 +1,136 @@
+"""
+Convert ISO-string timestamps to native BSON datetimes.
+
+The migration runs online: a document is only rewritten if the field still
+holds the string that was read, so concurrent writers are never clobbered.
+Progress is checkpointed in the `migrations` collection after every batch,
+so an interrupted run resumes where it stopped.
+
+Usage:
+    python migrate_datetimes.py [--batch-size 500] [--collection users] [--restart]
+"""
+import argparse
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("migrate_datetimes")
+
+# Collections and the fields that hold timestamps
+DATETIME_FIELDS = {
+    "users": ["created_at"],
+    "scp_objects": ["created_at"],
+    "chat_messages": ["timestamp"],
+    "dossier_submissions": ["submitted_at", "reviewed_at"],
+}
+
+def parse_timestamp(value: str) -> Optional[datetime]:
+    """Parse an ISO timestamp, treating naive values as UTC"""
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+async def migrate_collection(db, name: str, fields: list, batch_size: int, restart: bool) -> dict:
+    """Convert string timestamps in one collection, resuming from the last checkpoint"""
+    checkpoint_id = f"datetimes:{name}"
+    if restart:
+        await db.migrations.delete_one({"_id": checkpoint_id})
+
+    checkpoint = await db.migrations.find_one({"_id": checkpoint_id})
+    last_id = checkpoint["last_id"] if checkpoint else None
+    if checkpoint and checkpoint.get("done"):
+        logger.info(f"{name}: already migrated, skipping (use --restart to run again)")
+        return {"converted": 0, "failed": 0}
+
+    string_filter = {"$or": [{field: {"$type": "string"}} for field in fields]}
+    remaining = await db[name].count_documents(
+        {**string_filter, "_id": {"$gt": last_id}} if last_id is not None else string_filter
+    )
+    logger.info(f"{name}: {remaining} documents to convert" + (f", resuming after {last_id}" if last_id else ""))
+
+    converted = 0
+    failed = 0
+    while True:
+        query = dict(string_filter)
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+
+        batch = await db[name].find(query, {field: 1 for field in fields}).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not batch:
+            break
+
+        requests = []
+        for doc in batch:
+            match = {"_id": doc["_id"]}
+            update = {}
+            for field in fields:
+                value = doc.get(field)
+                if not isinstance(value, str):
+                    continue
+                parsed = parse_timestamp(value)
+                if parsed is None:
+                    failed += 1
+                    logger.warning(f"{name}: cannot parse {field}={value!r} on {doc['_id']}")
+                    continue
+                # Only rewrite if nobody changed the value since we read it
+                match[field] = value
+                update[field] = parsed
+            if update:
+                requests.append(UpdateOne(match, {"$set": update}))
+
+        if requests:
+            result = await db[name].bulk_write(requests, ordered=False)
+            converted += result.modified_count
+
+        last_id = batch[-1]["_id"]
+        await db.migrations.update_one(
+            {"_id": checkpoint_id},
+            {"$set": {"last_id": last_id, "updated_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+        logger.info(f"{name}: {converted}/{remaining} converted, {failed} unparseable")
+
+    await db.migrations.update_one(
+        {"_id": checkpoint_id},
+        {"$set": {"done": True, "updated_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+    logger.info(f"{name}: done, {converted} converted, {failed} unparseable")
+    return {"converted": converted, "failed": failed}
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--collection", action="append", choices=sorted(DATETIME_FIELDS),
+                        help="Limit the migration to this collection (repeatable)")
+    parser.add_argument("--restart", action="store_true", help="Ignore saved checkpoints")
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+    db = client[os.environ['DB_NAME']]
+    try:
+        for name in args.collection or DATETIME_FIELDS:
+            await migrate_collection(db, name, DATETIME_FIELDS[name], args.batch_size, args.restart)
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -30,6 +30,10 @@ class UserResponse(BaseModel):
     created_at: datetime
     is_active: bool
 
+class UserPage(BaseModel):
+    users: List[UserResponse]
+    next_cursor: Optional[str] = None
+
 class TokenResponse(BaseModel):
     access_token: str
     token_type: str
@@ -50,6 +54,8 @@ class SCPObject(BaseModel):
     image_url: Optional[str] = None
     is_classified: bool = False  # Deprecated, will use threat_class for access control
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    version: int = 0  # Catalog version of the last change, for delta sync
+    updated_at: Optional[datetime] = None
 
 class SCPObjectCreate(BaseModel):
     number: str
@@ -72,6 +78,20 @@ class SCPObjectUpdate(BaseModel):
     image_url: Optional[str] = None
     is_classified: Optional[bool] = None
 
+class SCPSearchHit(BaseModel):
+    number: str
+    name: str
+    codename: str
+    threat_class: str
+    image_url: Optional[str] = None
+    score: float
+    snippet: str
+
+class SCPChanges(BaseModel):
+    version: int  # Pass back as `since` on the next sync
+    changed: List[SCPObject]
+    deleted: List[str]  # Object numbers to drop
+
 # Chat Models
 class ChatMessage(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -145,4 +165,20 @@ class DossierSubmissionResponse(BaseModel):
 
 class DossierModerationRequest(BaseModel):
     status: str  # approved or rejected
-    admin_comment: Optional[str] = None
\ No newline at end of file
+    admin_comment: Optional[str] = None
+
+# Bulk Admin Models
+class BulkUserFilter(BaseModel):
+    username_prefix: Optional[str] = None
+    clearance_level: Optional[int] = None
+    is_active: Optional[bool] = None
+
+class BulkClearanceUpdate(BaseModel):
+    user_ids: Optional[List[str]] = None
+    filter: Optional[BulkUserFilter] = None
+    clearance_level: int
+
+class BulkStatusUpdate(BaseModel):
+    user_ids: Optional[List[str]] = None
+    filter: Optional[BulkUserFilter] = None
+    is_active: bool
@@ -0,0 +1,250 @@
+"""
+Opt-in request profiling and slow-request capture.
+
+Two modes, both writing JSON captures to a rotating local directory:
+
+- Slow-request capture (PROFILE_SLOW_MS > 0): a background thread samples the
+  event loop thread's stack every PROFILE_SAMPLE_INTERVAL_MS. When a request
+  takes longer than the threshold, the samples taken during it are folded
+  into a capture together with the Mongo commands it issued.
+- Forced profiling: an admin sends `X-Profile-Request: 1` and that request
+  runs under cProfile regardless of its latency.
+
+Both modes observe the whole event loop thread, so a capture can include
+work from other requests that were interleaved with the profiled one.
+"""
+import asyncio
+import contextvars
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Awaitable, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = b"x-profile-request"
+CAPTURE_NAME_PATTERN = re.compile(r"^[\w.-]+\.json$")
+
+
+class RequestTrace:
+    """Per-request record of the Mongo commands issued while handling it"""
+
+    def __init__(self):
+        self.queries: List[dict] = []
+
+    def add_query(self, command: str, collection: str, duration_seconds: float, failed: bool = False):
+        self.queries.append({
+            "command": command,
+            "collection": collection,
+            "duration_ms": round(duration_seconds * 1000, 3),
+            "failed": failed,
+        })
+
+
+current_trace: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar("current_trace", default=None)
+
+
+def record_query(command: str, collection: str, duration_seconds: float, failed: bool = False):
+    """Attach a Mongo command to the request being traced, if any.
+
+    Motor copies the caller's context into its executor threads, so this sees
+    the trace of the request that issued the command.
+    """
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add_query(command, collection, duration_seconds, failed)
+
+
+class StackSampler:
+    """Background thread sampling one thread's Python stack into a ring buffer"""
+
+    def __init__(self, interval_seconds: float = 0.005, window_seconds: float = 120.0, max_depth: int = 64):
+        self.interval_seconds = interval_seconds
+        self.max_depth = max_depth
+        self.samples: deque = deque(maxlen=int(window_seconds / interval_seconds))
+        self._target_thread_id: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, target_thread_id: int):
+        self._target_thread_id = target_thread_id
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            frame = sys._current_frames().get(self._target_thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            self.samples.append((time.monotonic(), tuple(reversed(stack))))
+
+    def collect(self, start: float, end: float, top: int = 50) -> dict:
+        """Fold the samples taken between two monotonic timestamps"""
+        stacks = [stack for timestamp, stack in list(self.samples) if start <= timestamp <= end]
+        folded = Counter(";".join(stack) for stack in stacks)
+        leaves = Counter(stack[-1] for stack in stacks if stack)
+        return {
+            "type": "sampling",
+            "interval_ms": self.interval_seconds * 1000,
+            "sample_count": len(stacks),
+            "top_functions": leaves.most_common(top),
+            "folded_stacks": dict(folded.most_common(top)),
+        }
+
+
+class CaptureStore:
+    """Directory of JSON captures that keeps only the newest max_captures files"""
+
+    def __init__(self, directory: Path, max_captures: int = 50):
+        self.directory = directory
+        self.max_captures = max_captures
+
+    def write(self, capture: dict) -> str:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+        slug = re.sub(r"[^\w]+", "_", capture["path"]).strip("_")[:60]
+        name = f"{stamp}-{capture['method']}-{slug}.json"
+        (self.directory / name).write_text(json.dumps(capture, ensure_ascii=False, indent=1), encoding="utf-8")
+        self._rotate()
+        return name
+
+    def _rotate(self):
+        files = sorted(self.directory.glob("*.json"))
+        for old in files[:-self.max_captures]:
+            old.unlink(missing_ok=True)
+
+    def list(self) -> List[dict]:
+        if not self.directory.exists():
+            return []
+        captures = []
+        for path in sorted(self.directory.glob("*.json"), reverse=True):
+            stat = path.stat()
+            captures.append({
+                "name": path.name,
+                "size": stat.st_size,
+                "created_at": datetime.fromtimestamp(stat.st_mtime, timezone.utc),
+            })
+        return captures
+
+    def read(self, name: str) -> Optional[dict]:
+        if not CAPTURE_NAME_PATTERN.match(name):
+            return None
+        path = self.directory / name
+        if not path.is_file():
+            return None
+        return json.loads(path.read_text(encoding="utf-8"))
+
+
+def cprofile_stats(profiler: cProfile.Profile, top: int = 50) -> dict:
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.sort_stats("cumulative").print_stats(top)
+    return {"type": "cprofile", "stats": stream.getvalue()}
+
+
+class ProfilingMiddleware:
+    """ASGI middleware capturing profiles of slow or explicitly requested requests"""
+
+    # Only one cProfile profiler can be attached to the loop thread at a time
+    _cprofile_busy = False
+
+    def __init__(
+        self,
+        app,
+        store: CaptureStore,
+        sampler: Optional[StackSampler],
+        slow_threshold_seconds: float,
+        authorize: Callable[[str], Awaitable[bool]]
+    ):
+        self.app = app
+        self.store = store
+        self.sampler = sampler
+        self.slow_threshold_seconds = slow_threshold_seconds
+        self.authorize = authorize
+
+    async def _wants_profile(self, scope) -> bool:
+        """Claim the cProfile slot for an authorized forced-profile request"""
+        headers = dict(scope["headers"])
+        if headers.get(PROFILE_HEADER) != b"1" or ProfilingMiddleware._cprofile_busy:
+            return False
+        # Claimed before the await, so a concurrent request cannot claim it as well
+        ProfilingMiddleware._cprofile_busy = True
+        authorized = False
+        try:
+            authorized = await self.authorize(headers.get(b"authorization", b"").decode("latin-1"))
+        finally:
+            if not authorized:
+                ProfilingMiddleware._cprofile_busy = False
+        return authorized
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        forced = await self._wants_profile(scope)
+        if not forced and self.sampler is None:
+            await self.app(scope, receive, send)
+            return
+
+        status_holder = {"status": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder["status"] = message["status"]
+            await send(message)
+
+        trace = RequestTrace()
+        token = current_trace.set(trace)
+        profiler = cProfile.Profile() if forced else None
+        start = time.monotonic()
+        try:
+            if profiler:
+                profiler.enable()
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if profiler:
+                profiler.disable()
+                ProfilingMiddleware._cprofile_busy = False
+            end = time.monotonic()
+            current_trace.reset(token)
+
+            duration = end - start
+            if forced or duration >= self.slow_threshold_seconds:
+                capture = {
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status": status_holder["status"],
+                    "duration_ms": round(duration * 1000, 3),
+                    "reason": "forced" if forced else "slow",
+                    "captured_at": datetime.now(timezone.utc).isoformat(),
+                    "queries": trace.queries,
+                    "profile": cprofile_stats(profiler) if profiler else self.sampler.collect(start, end),
+                }
+                try:
+                    name = await asyncio.to_thread(self.store.write, capture)
+                    logger.info(f"Profile captured for {scope['method']} {scope['path']} ({capture['duration_ms']} ms): {name}")
+                except OSError as e:
+                    logger.warning(f"Could not write profile capture: {e}")
@@ -0,0 +1,300 @@
+"""
+In-process publish/subscribe hub with pluggable backends.
+
+Subscribers always live in the local process; the backend decides how a
+published message reaches the hubs of the other workers:
+
+    local   - this process only
+    mongo   - capped MongoDB collection tailed by every worker
+    socket  - SocketHub on a local Unix socket, started by run.py
+"""
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import uuid
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+Deliver = Callable[[str, dict], Awaitable[None]]
+
+DEFAULT_SOCKET_PATH = os.path.join(tempfile.gettempdir(), "esmal-pubsub.sock")
+
+
+class LocalBackend:
+    """Deliver messages to subscribers of this process only"""
+
+    def __init__(self):
+        self._deliver: Optional[Deliver] = None
+
+    async def start(self, deliver: Deliver):
+        self._deliver = deliver
+
+    async def publish(self, channel: str, message: dict):
+        if self._deliver:
+            await self._deliver(channel, message)
+
+    async def stop(self):
+        self._deliver = None
+
+
+class MongoBackend:
+    """Share messages between workers through a capped MongoDB collection"""
+
+    def __init__(self, db, collection_name: str = "pubsub_events", size_bytes: int = 8 * 1024 * 1024):
+        self.db = db
+        self.collection_name = collection_name
+        self.size_bytes = size_bytes
+        self._deliver: Optional[Deliver] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, deliver: Deliver):
+        self._deliver = deliver
+        existing = await self.db.list_collection_names(filter={"name": self.collection_name})
+        if not existing:
+            try:
+                await self.db.create_collection(self.collection_name, capped=True, size=self.size_bytes)
+            except Exception as e:
+                # Another worker created it first
+                logger.debug(f"Capped collection {self.collection_name} not created: {e}")
+        self._task = asyncio.create_task(self._tail())
+
+    async def publish(self, channel: str, message: dict):
+        await self.db[self.collection_name].insert_one({
+            "event_id": str(uuid.uuid4()),
+            "channel": channel,
+            "message": message,
+        })
+
+    async def _tail(self):
+        """Follow the capped collection and hand new events to the local hub"""
+        from pymongo import CursorType
+
+        collection = self.db[self.collection_name]
+        last = await collection.find_one({}, sort=[("$natural", -1)])
+        last_id = last["_id"] if last else None
+
+        while True:
+            query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+            cursor = collection.find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+            try:
+                while cursor.alive:
+                    async for doc in cursor:
+                        last_id = doc["_id"]
+                        await self._deliver(doc["channel"], doc["message"])
+                    await asyncio.sleep(0.1)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Pub/sub tail interrupted, retrying: {e}")
+                await asyncio.sleep(1)
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._deliver = None
+
+
+class SocketBackend:
+    """Share messages between workers through a SocketHub on a local Unix socket"""
+
+    def __init__(self, path: str, reconnect_delay: float = 0.5, publish_timeout: float = 2.0):
+        self.path = path
+        self.reconnect_delay = reconnect_delay
+        self.publish_timeout = publish_timeout
+        self._deliver: Optional[Deliver] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._connected = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, deliver: Deliver, timeout: float = 10.0):
+        self._deliver = deliver
+        self._task = asyncio.create_task(self._run())
+        await asyncio.wait_for(self._connected.wait(), timeout)
+
+    async def _run(self):
+        while True:
+            try:
+                reader, self._writer = await asyncio.open_unix_connection(self.path)
+                self._connected.set()
+                while line := await reader.readline():
+                    envelope = json.loads(line)
+                    await self._deliver(envelope["channel"], envelope["message"])
+                logger.warning("Pub/sub hub closed the connection, reconnecting")
+            except asyncio.CancelledError:
+                raise
+            except (OSError, ValueError) as e:
+                logger.warning(f"Pub/sub hub unavailable at {self.path}: {e}")
+            self._connected.clear()
+            self._writer = None
+            await asyncio.sleep(self.reconnect_delay)
+
+    async def publish(self, channel: str, message: dict):
+        """Send a message to the hub; dropped with a warning if the hub stays unreachable"""
+        try:
+            await asyncio.wait_for(self._connected.wait(), self.publish_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Pub/sub hub unavailable, dropping message on {channel}")
+            return
+        writer = self._writer
+        if writer is None:
+            # Disconnected between the wait and now
+            logger.warning(f"Pub/sub hub disconnected, dropping message on {channel}")
+            return
+        try:
+            writer.write(json.dumps({"channel": channel, "message": message}, default=str).encode("utf-8") + b"\n")
+            await asyncio.wait_for(writer.drain(), self.publish_timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            logger.warning(f"Pub/sub publish on {channel} failed, dropping message: {e!r}")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+        self._deliver = None
+
+
+class SocketHub:
+    """Fan every line received from one client out to all connected clients.
+
+    A client that does not take its lines within drain_timeout is
+    disconnected, so one stuck worker cannot grow the hub's buffers without
+    limit; its backend reconnects on its own.
+    """
+
+    def __init__(self, path: str, drain_timeout: float = 2.0):
+        self.path = path
+        self.drain_timeout = drain_timeout
+        self._clients: Set[asyncio.StreamWriter] = set()
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._handle, path=self.path)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._clients.add(writer)
+        try:
+            while line := await reader.readline():
+                clients = list(self._clients)
+                for client in clients:
+                    try:
+                        client.write(line)
+                    except Exception:
+                        self._drop(client)
+                await asyncio.gather(*(self._drain(client) for client in clients if client in self._clients))
+        finally:
+            self._clients.discard(writer)
+            writer.close()
+
+    async def _drain(self, client: asyncio.StreamWriter):
+        try:
+            await asyncio.wait_for(client.drain(), self.drain_timeout)
+        except Exception as e:
+            logger.warning(f"Disconnecting pub/sub client that is not keeping up: {e!r}")
+            self._drop(client)
+
+    def _drop(self, client: asyncio.StreamWriter):
+        self._clients.discard(client)
+        # abort, not close: close would wait to flush the buffer the client is not reading
+        client.transport.abort()
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            for client in list(self._clients):
+                client.close()
+            await self._server.wait_closed()
+            self._server = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class Subscription:
+    """Bounded queue of messages for one channel"""
+
+    def __init__(self, hub: "PubSub", channel: str, maxsize: int):
+        self.hub = hub
+        self.channel = channel
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+
+    async def get(self) -> dict:
+        return await self.queue.get()
+
+    def put(self, message: dict):
+        # Slow consumers lose the oldest message rather than blocking publishers
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(message)
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PubSub:
+    """Channel-based fan-out to local subscribers"""
+
+    def __init__(self, backend=None, queue_size: int = 100):
+        self.backend = backend or LocalBackend()
+        self.queue_size = queue_size
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+
+    async def start(self):
+        await self.backend.start(self._deliver)
+
+    async def stop(self):
+        await self.backend.stop()
+
+    def subscribe(self, channel: str) -> Subscription:
+        subscription = Subscription(self, channel, self.queue_size)
+        self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscribers = self._subscribers.get(subscription.channel)
+        if subscribers:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.channel]
+
+    async def publish(self, channel: str, message: dict):
+        await self.backend.publish(channel, message)
+
+    async def _deliver(self, channel: str, message: dict):
+        for subscription in list(self._subscribers.get(channel, ())):
+            subscription.put(message)
+
+
+def create_backend(name: str, db=None):
+    """Build a backend from its configured name"""
+    if name == "local":
+        return LocalBackend()
+    if name == "mongo":
+        return MongoBackend(db)
+    if name == "socket":
+        return SocketBackend(
+            os.environ.get('PUBSUB_SOCKET', DEFAULT_SOCKET_PATH),
+            publish_timeout=float(os.environ.get('PUBSUB_PUBLISH_TIMEOUT_S', '2'))
+        )
+    raise ValueError(f"Unknown pub/sub backend: {name}")
@@ -0,0 +1,162 @@
+"""
+Token-bucket rate limiting for expensive endpoints.
+
+Each RateLimiter refills `rate` tokens per second up to `burst`, and every
+request takes one token from the bucket named by its key (user id, session
+id or client IP). Buckets live in a store:
+
+    local   - this process only (default)
+    mongo   - shared by all workers through the `rate_limits` collection,
+              updated atomically with one pipeline update per request
+"""
+import asyncio
+import math
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+
+import metrics
+
+RATE_LIMIT_DECISIONS_TOTAL = metrics.counter(
+    "rate_limit_decisions_total", "Rate limiter decisions by limiter and outcome", ["limiter", "outcome"]
+)
+RATE_LIMIT_STORE_ERRORS_TOTAL = metrics.counter(
+    "rate_limit_store_errors_total", "Rate limiter store failures; requests are allowed when the store fails", ["limiter"]
+)
+
+
+class LocalStore:
+    """Buckets kept in this process, least recently used dropped first"""
+
+    def __init__(self, maxsize: int = 100000):
+        self.maxsize = maxsize
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = asyncio.Lock()
+
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1) -> Tuple[bool, float]:
+        """Take cost tokens; returns (allowed, tokens left)"""
+        async with self._lock:
+            now = time.monotonic()
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+            return allowed, tokens
+
+    async def give(self, key: str, burst: float, cost: float = 1):
+        """Return cost tokens taken earlier, up to burst"""
+        async with self._lock:
+            if key in self._buckets:
+                tokens, updated = self._buckets[key]
+                self._buckets[key] = (min(burst, tokens + cost), updated)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class MongoStore:
+    """Buckets shared between workers in a MongoDB collection"""
+
+    def __init__(self, db, collection_name: str = "rate_limits"):
+        self.db = db
+        self.collection_name = collection_name
+
+    async def ensure_indexes(self):
+        # Idle buckets are full again anyway, so let MongoDB drop them
+        await self.db[self.collection_name].create_index("expire_at", expireAfterSeconds=0)
+
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1) -> Tuple[bool, float]:
+        from pymongo import ReturnDocument
+
+        now = time.time()
+        refilled = {"$min": [burst, {"$add": [
+            {"$ifNull": ["$tokens", burst]},
+            {"$multiply": [{"$max": [0, {"$subtract": [now, {"$ifNull": ["$updated", now]}]}]}, rate]},
+        ]}]}
+        bucket = await self.db[self.collection_name].find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"refilled": refilled}},
+                {"$set": {
+                    "allowed": {"$gte": ["$refilled", cost]},
+                    "tokens": {"$cond": [{"$gte": ["$refilled", cost]}, {"$subtract": ["$refilled", cost]}, "$refilled"]},
+                    "updated": now,
+                    "expire_at": datetime.now(timezone.utc) + timedelta(seconds=burst / rate if rate else 3600),
+                }},
+                {"$unset": "refilled"},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return bucket["allowed"], bucket["tokens"]
+
+    async def give(self, key: str, burst: float, cost: float = 1):
+        await self.db[self.collection_name].update_one(
+            {"_id": key},
+            [{"$set": {"tokens": {"$min": [burst, {"$add": ["$tokens", cost]}]}}}]
+        )
+
+
+class RateLimiter:
+    """One token-bucket policy, applied per key"""
+
+    def __init__(self, name: str, per_minute: float, burst: float, store=None):
+        self.name = name
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.store = store or LocalStore()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0 and self.burst > 0
+
+    async def hit(self, key: str, cost: float = 1) -> float:
+        """Take a token for key; returns 0 when allowed, otherwise seconds until one is available"""
+        if not self.enabled:
+            return 0
+        try:
+            allowed, tokens = await self.store.take(f"{self.name}:{key}", self.rate, self.burst, cost)
+        except Exception:
+            # A broken shared store must not take the endpoint down with it
+            RATE_LIMIT_STORE_ERRORS_TOTAL.inc(limiter=self.name)
+            return 0
+        RATE_LIMIT_DECISIONS_TOTAL.inc(limiter=self.name, outcome="allowed" if allowed else "limited")
+        if allowed:
+            return 0
+        return (cost - tokens) / self.rate
+
+    async def refund(self, key: str, cost: float = 1):
+        """Give back a token taken by hit() for a request that was rejected elsewhere"""
+        if not self.enabled:
+            return
+        try:
+            await self.store.give(f"{self.name}:{key}", self.burst, cost)
+        except Exception:
+            RATE_LIMIT_STORE_ERRORS_TOTAL.inc(limiter=self.name)
+
+
+def retry_after_header(seconds: float) -> str:
+    """Retry-After takes whole seconds"""
+    return str(max(1, math.ceil(seconds)))
+
+
+def create_store(name: str, db=None):
+    """Build a bucket store from its configured name"""
+    if name == "local":
+        return LocalStore()
+    if name == "mongo":
+        return MongoStore(db)
+    raise ValueError(f"Unknown rate limit store: {name}")
+
+
+def client_ip(scope_client: Optional[tuple], forwarded_for: Optional[str], trust_forwarded: bool) -> str:
+    """Address of the caller, optionally taken from the first X-Forwarded-For hop"""
+    if trust_forwarded and forwarded_for:
+        return forwarded_for.split(",")[0].strip()
+    return scope_client[0] if scope_client else "unknown"
@@ -0,0 +1,246 @@
+"""
+Chat history retention and archival.
+
+Messages carry an `expire_at` that MongoDB's TTL monitor acts on:
+anonymous sessions expire CHAT_ANONYMOUS_TTL_HOURS after each message,
+authenticated ones after CHAT_RETENTION_DAYS (0 keeps them forever).
+
+ChatCompactor periodically rolls authenticated sessions that have been idle
+for CHAT_ARCHIVE_AFTER_HOURS into one zlib-compressed BSON document per
+session in `chat_archives`, so the live collection and its indexes only
+hold active conversations. Archives are written before the live messages
+are deleted, and readers merge both by message id, so an interrupted run
+never loses or duplicates history. Every write to an authenticated session
+moves its `last_active` in `chat_sessions`, so finding idle sessions is an
+index range scan rather than a pass over every live message.
+"""
+import asyncio
+import logging
+import os
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+ANONYMOUS_TTL = timedelta(hours=float(os.environ.get('CHAT_ANONYMOUS_TTL_HOURS', '24')))
+AUTHENTICATED_RETENTION_DAYS = float(os.environ.get('CHAT_RETENTION_DAYS', '0'))
+ARCHIVE_CODEC = "zlib+bson"
+
+CHAT_SESSIONS_ARCHIVED_TOTAL = metrics.counter(
+    "chat_sessions_archived_total", "Chat sessions rolled into an archive document"
+)
+CHAT_MESSAGES_ARCHIVED_TOTAL = metrics.counter(
+    "chat_messages_archived_total", "Live chat messages moved into archives"
+)
+CHAT_COMPACTION_SECONDS = metrics.histogram(
+    "chat_compaction_duration_seconds", "Duration of one chat compaction run"
+)
+
+
+def message_expiry(user_id: Optional[str], timestamp: datetime) -> Optional[datetime]:
+    """When a message written at timestamp should be removed, if ever"""
+    if user_id is None:
+        return timestamp + ANONYMOUS_TTL
+    if AUTHENTICATED_RETENTION_DAYS > 0:
+        return timestamp + timedelta(days=AUTHENTICATED_RETENTION_DAYS)
+    return None
+
+
+def with_expiry(message: dict) -> dict:
+    """Set expire_at on a new chat message document when it should expire"""
+    expire_at = message_expiry(message["user_id"], message["timestamp"])
+    if expire_at is not None:
+        message["expire_at"] = expire_at
+    return message
+
+
+def encode_messages(messages: List[dict]):
+    import bson
+
+    return bson.Binary(zlib.compress(bson.encode({"messages": messages}), 6))
+
+
+def decode_messages(data: bytes) -> List[dict]:
+    import bson
+    from bson.codec_options import CodecOptions
+
+    options = CodecOptions(tz_aware=True, tzinfo=timezone.utc)
+    return bson.decode(zlib.decompress(data), codec_options=options)["messages"]
+
+
+def merge_messages(*batches: List[dict]) -> List[dict]:
+    """Combine message lists, dropping duplicate ids, in (timestamp, id) order"""
+    by_id = {}
+    for batch in batches:
+        for message in batch:
+            by_id[message["id"]] = message
+    return sorted(by_id.values(), key=lambda message: (message["timestamp"], message["id"]))
+
+
+async def ensure_indexes(db):
+    await db.chat_messages.create_index("expire_at", expireAfterSeconds=0)
+    await db.chat_sessions.create_index("session_id", unique=True)
+    await db.chat_sessions.create_index("last_active")
+    await db.chat_archives.create_index("session_id", unique=True)
+    await db.chat_archives.create_index("expire_at", expireAfterSeconds=0)
+
+
+async def touch_session(db, message: dict):
+    """Record activity on an authenticated session so the compactor can find it when idle"""
+    if message["user_id"] is None:
+        return
+    await db.chat_sessions.update_one(
+        {"session_id": message["session_id"]},
+        {"$max": {"last_active": message["timestamp"]}, "$set": {"user_id": message["user_id"]}},
+        upsert=True
+    )
+
+
+async def backfill_sessions(db) -> int:
+    """Build chat_sessions from live messages written before it existed; runs once"""
+    from pymongo import UpdateOne
+
+    if await db.chat_sessions.find_one({}, {"_id": 1}):
+        return 0
+    groups = await db.chat_messages.aggregate([
+        {"$match": {"user_id": {"$ne": None}}},
+        {"$group": {"_id": "$session_id", "last": {"$max": "$timestamp"}, "user_id": {"$last": "$user_id"}}},
+    ]).to_list(None)
+    if groups:
+        await db.chat_sessions.bulk_write([
+            UpdateOne(
+                {"session_id": group["_id"]},
+                {"$max": {"last_active": group["last"]}, "$set": {"user_id": group["user_id"]}},
+                upsert=True
+            )
+            for group in groups
+        ], ordered=False)
+    return len(groups)
+
+
+async def load_archived(db, session_id: str) -> List[dict]:
+    """Archived messages of a session, oldest first"""
+    archive = await db.chat_archives.find_one({"session_id": session_id}, {"_id": 0, "data": 1})
+    if not archive:
+        return []
+    return decode_messages(archive["data"])
+
+
+async def recent_messages(db, session_id: str, limit: int) -> List[dict]:
+    """The last `limit` messages of a session, topped up from its archive"""
+    live = await db.chat_messages.find(
+        {"session_id": session_id},
+        {"_id": 0}
+    ).sort([("timestamp", -1), ("id", -1)]).to_list(limit)
+    live.reverse()
+    if len(live) < limit:
+        live = merge_messages(await load_archived(db, session_id), live)[-limit:]
+    return live
+
+
+class ChatCompactor:
+    """Background job moving idle authenticated sessions into archives"""
+
+    def __init__(self, db, archive_after: timedelta, interval_seconds: float, batch_size: int = 100):
+        self.db = db
+        self.archive_after = archive_after
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.interval_seconds > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            try:
+                await self.compact()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Chat compaction failed: {e}")
+
+    async def idle_sessions(self, now: datetime) -> List[str]:
+        """Authenticated sessions with live messages and no activity since the cutoff"""
+        cursor = self.db.chat_sessions.find(
+            {"last_active": {"$lt": now - self.archive_after}},
+            {"_id": 0, "session_id": 1}
+        ).sort("last_active", 1).limit(self.batch_size)
+        return [session["session_id"] async for session in cursor]
+
+    async def compact(self) -> int:
+        """Archive one batch of idle sessions; returns the number of messages moved"""
+        start = time.perf_counter()
+        moved = 0
+        for session_id in await self.idle_sessions(datetime.now(timezone.utc)):
+            moved += await self.compact_session(session_id)
+        CHAT_COMPACTION_SECONDS.observe(time.perf_counter() - start)
+        if moved:
+            logger.info(f"Archived {moved} chat messages")
+        return moved
+
+    async def compact_session(self, session_id: str) -> int:
+        from pymongo.errors import DuplicateKeyError
+
+        live = await self.db.chat_messages.find({"session_id": session_id}, {"_id": 0}).to_list(None)
+        if not live:
+            await self.db.chat_sessions.delete_one({"session_id": session_id})
+            return 0
+        archive = await self.db.chat_archives.find_one({"session_id": session_id}, {"_id": 0})
+        version = archive["version"] if archive else 0
+        messages = merge_messages(decode_messages(archive["data"]) if archive else [], live)
+        for message in messages:
+            message.pop("expire_at", None)
+
+        last = messages[-1]
+        expiries = [message_expiry(message.get("user_id"), message["timestamp"]) for message in messages]
+        document = {
+            "session_id": session_id,
+            "user_id": last.get("user_id"),
+            "message_count": len(messages),
+            "first_timestamp": messages[0]["timestamp"],
+            "last_timestamp": last["timestamp"],
+            "codec": ARCHIVE_CODEC,
+            "data": encode_messages(messages),
+            "version": version + 1,
+            "updated_at": datetime.now(timezone.utc),
+            "expire_at": None if None in expiries else max(expiries),
+        }
+
+        # Another worker compacting the same session wins; its archive holds these messages too
+        try:
+            await self.db.chat_archives.replace_one(
+                {"session_id": session_id, "version": version},
+                document,
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return 0
+
+        await self.db.chat_messages.delete_many({
+            "session_id": session_id,
+            "id": {"$in": [message["id"] for message in live]}
+        })
+        # Unless a message arrived meanwhile, nothing live is left to archive
+        await self.db.chat_sessions.delete_one({
+            "session_id": session_id,
+            "last_active": {"$lte": max(message["timestamp"] for message in live)}
+        })
+        CHAT_SESSIONS_ARCHIVED_TOTAL.inc()
+        CHAT_MESSAGES_ARCHIVED_TOTAL.inc(len(live))
+        return len(live)
@@ -0,0 +1,117 @@
+"""
+Catalog retrieval for MAL0's answers.
+
+Passages are rendered once per clearance level when an object is indexed:
+partition N only holds objects visible at level N, and only partition 5
+includes secret_data, so a lookup at a lower level cannot return it.
+Ranking reuses the catalog SearchIndex; a retrieval is pure in-memory work,
+with no database round trip per chat turn.
+"""
+import math
+import time
+from typing import Dict, List
+
+import metrics
+from models import get_required_clearance
+from search_index import SearchIndex
+
+CLEARANCE_LEVELS = (1, 2, 3, 4, 5)
+SECRET_CLEARANCE = 5
+
+# Cyrillic text averages roughly three characters per model token
+CHARS_PER_TOKEN = 3
+
+RETRIEVAL_SECONDS = metrics.histogram(
+    "rag_retrieval_duration_seconds", "Time spent selecting catalog passages for a chat turn",
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05)
+)
+RETRIEVALS_TOTAL = metrics.counter(
+    "rag_retrievals_total", "Chat turns by whether catalog passages were injected", ["outcome"]
+)
+RETRIEVED_TOKENS = metrics.histogram(
+    "rag_context_tokens", "Estimated tokens of catalog context injected per chat turn",
+    buckets=(0, 50, 100, 200, 400, 800, 1600, 3200)
+)
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def render_passage(obj: dict, include_secret: bool) -> str:
+    lines = [f"Объект {obj['number']} — {obj['name']} («{obj['codename']}»), класс угрозы: {obj['threat_class']}."]
+    if obj.get("description"):
+        lines.append(f"Описание: {obj['description']}")
+    if obj.get("special_procedures"):
+        lines.append(f"Процедуры содержания: {obj['special_procedures']}")
+    if include_secret and obj.get("secret_data"):
+        lines.append(f"Секретные данные: {obj['secret_data']}")
+    return "\n".join(lines)
+
+
+def truncate_to_tokens(text: str, tokens: int) -> str:
+    """Cut text at a word boundary so it fits in the given number of tokens"""
+    limit = tokens * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    cut = text.rfind(" ", 0, limit - 1)
+    return text[:cut if cut > 0 else limit - 1].rstrip() + "…"
+
+
+class CatalogRetriever:
+    """Clearance-partitioned passages ranked by the catalog search index"""
+
+    def __init__(self, index: SearchIndex, top_k: int = 3, token_budget: int = 600, min_score: float = 0.5):
+        self.index = index
+        self.top_k = top_k
+        self.token_budget = token_budget
+        self.min_score = min_score
+        self.partitions: Dict[int, Dict[str, str]] = {level: {} for level in CLEARANCE_LEVELS}
+
+    def rebuild(self, objects: List[dict]):
+        for partition in self.partitions.values():
+            partition.clear()
+        for obj in objects:
+            self.add(obj)
+
+    def add(self, obj: dict):
+        """Render an object's passages; obj must be the full document, secret_data included"""
+        self.remove(obj["number"])
+        required = get_required_clearance(obj.get("threat_class", ""))
+        for level, partition in self.partitions.items():
+            if level >= required:
+                partition[obj["number"]] = render_passage(obj, include_secret=level >= SECRET_CLEARANCE)
+
+    def remove(self, number: str):
+        for partition in self.partitions.values():
+            partition.pop(number, None)
+
+    def retrieve(self, query: str, clearance_level: int) -> List[str]:
+        """Most relevant passages visible at a clearance level, within the token budget"""
+        start = time.perf_counter()
+        partition = self.partitions.get(clearance_level, self.partitions[CLEARANCE_LEVELS[0]])
+        passages = []
+        remaining = self.token_budget
+        for score, doc in self.index.search(query, clearance_level, self.top_k):
+            if score < self.min_score or remaining <= 0:
+                break
+            passage = partition.get(doc["number"])
+            if passage is None:
+                continue
+            passage = truncate_to_tokens(passage, remaining)
+            passages.append(passage)
+            remaining -= estimate_tokens(passage)
+        RETRIEVAL_SECONDS.observe(time.perf_counter() - start)
+        RETRIEVALS_TOTAL.inc(outcome="hit" if passages else "empty")
+        RETRIEVED_TOKENS.observe(self.token_budget - max(remaining, 0))
+        return passages
+
+
+def context_block(passages: List[str]) -> str:
+    """Prompt section carrying the retrieved passages"""
+    if not passages:
+        return ""
+    return (
+        "\n\nСведения из базы данных ES по теме вопроса. Опирайся на них, когда говоришь об этих объектах, "
+        "и не придумывай фактов, которых здесь нет:\n\n" + "\n\n".join(passages)
+    )
@@ -0,0 +1,63 @@
+"""
+Multi-process runner for the API.
+
+Starts the local pub/sub hub in this process, then uvicorn with one worker
+per core (or --workers / WEB_CONCURRENCY). Every worker connects to the hub
+through PUBSUB_BACKEND=socket, so cache invalidations and dossier
+notifications reach all of them. Set PUBSUB_BACKEND=mongo instead to share
+events through MongoDB when workers run on several hosts; the hub is then
+not started.
+
+Usage:
+    python run.py [--workers 4] [--host 0.0.0.0] [--port 8001]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import threading
+
+import uvicorn
+
+from logging_setup import configure_from_env
+from pubsub import DEFAULT_SOCKET_PATH, SocketHub
+
+logger = logging.getLogger("run")
+
+def start_hub(path: str) -> SocketHub:
+    """Run the pub/sub hub on its own event loop in a daemon thread"""
+    hub = SocketHub(path, float(os.environ.get('PUBSUB_HUB_DRAIN_TIMEOUT_S', '2')))
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+
+    def serve():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(hub.start())
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=serve, name="pubsub-hub", daemon=True).start()
+    ready.wait(timeout=10)
+    logger.info(f"Pub/sub hub listening on {path}")
+    return hub
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=int(os.environ.get('WEB_CONCURRENCY', os.cpu_count() or 1)))
+    parser.add_argument("--host", default=os.environ.get('HOST', '0.0.0.0'))
+    parser.add_argument("--port", type=int, default=int(os.environ.get('PORT', '8001')))
+    args = parser.parse_args()
+
+    # The same setup server.py applies, so a single-worker run keeps every LOG_* option
+    configure_from_env()
+
+    # Workers inherit the environment, so configure the backend before spawning them
+    os.environ.setdefault('PUBSUB_BACKEND', 'socket')
+    os.environ.setdefault('PUBSUB_SOCKET', DEFAULT_SOCKET_PATH)
+    if os.environ['PUBSUB_BACKEND'] == 'socket':
+        start_hub(os.environ['PUBSUB_SOCKET'])
+
+    uvicorn.run("server:app", host=args.host, port=args.port, workers=args.workers)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+In-process full-text index over the SCP catalog.
+
+Text is lowercased, `ё` folded into `е`, split into words, stripped of
+stop words and reduced with a light suffix-stripping Russian stemmer, so
+"объекты", "объекта" and "объектом" all meet at "объект". Documents are
+ranked with BM25 over field-weighted term frequencies; the last query word
+also matches as a prefix so the search box works while typing.
+
+secret_data is never indexed. Every document remembers the clearance level
+its threat class requires, and results are filtered by it.
+"""
+import bisect
+import math
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from models import get_required_clearance
+
+FIELD_WEIGHTS = {
+    "number": 4.0,
+    "name": 3.0,
+    "codename": 3.0,
+    "description": 1.0,
+    "special_procedures": 0.5,
+}
+
+# Kept with each document so results and snippets need no database round trip
+STORED_FIELDS = ("number", "name", "codename", "threat_class", "image_url", "description", "special_procedures")
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+PREFIX_WEIGHT = 0.5
+MAX_PREFIX_EXPANSIONS = 20
+MIN_STEM_LENGTH = 3
+
+WORD_RE = re.compile(r"[0-9a-zа-я]+")
+
+STOP_WORDS = frozenset("""
+и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по
+только ее мне было вот от меня еще нет о из ему когда даже ну ли если уже или ни
+быть был него до вас нибудь уж вам ведь там потом себя ей может они тут где есть
+надо ней для мы тебя их чем была сам чтоб без чего раз тоже себе под будет ж
+тогда кто этот того потому этого какой ним здесь этом один мой тем чтобы нее были
+куда зачем всех можно при об другой хоть после над больше тот через эти нас про
+всего них какая много эту моя свою этой перед им более всегда между это
+the a an of and or to in on for is are
+""".split())
+
+REFLEXIVE_ENDINGS = ("ся", "сь")
+
+# Adjective, participle, verb and noun endings, longest tried first
+ENDINGS = tuple(sorted(set("""
+ившись ывшись вшись ивши ывши вши ейше ейш
+ими ыми его ого ему ому ее ие ые ое ей ий ый ой ем им ым ом их ых ую юю ая яя ою ею
+ующ ющ ащ ящ ивш ывш вш енн анн янн
+ила ыла ена ейте уйте ите или ыли ил ыл ен ило ыло ено ят ует уют ит ыт ены ить ыть ишь
+ла на ете йте ли ло но ет ют ны ть ешь
+иями ями ами ией иям ием иях ев ов ье еи ии ям ам ах ях ию ью ия ья ость ост
+а е и й о у ы ь ю я
+""".split()), key=len, reverse=True))
+
+
+def normalize(text: str) -> List[str]:
+    """Lowercase, fold ё and split into words"""
+    return WORD_RE.findall(text.lower().replace("ё", "е"))
+
+
+def stem(word: str) -> str:
+    """Strip one inflectional ending, keeping at least MIN_STEM_LENGTH letters"""
+    if word.isdigit() or len(word) <= MIN_STEM_LENGTH:
+        return word
+    if word.isascii():
+        if len(word) > 4 and word.endswith("es"):
+            return word[:-2]
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            return word[:-1]
+        return word
+    for ending in REFLEXIVE_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+            word = word[:-len(ending)]
+            break
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+            return word[:-len(ending)]
+    return word
+
+
+def analyze(text: Optional[str]) -> List[str]:
+    """Terms of a text as they are stored in the index"""
+    if not text:
+        return []
+    return [stem(word) for word in normalize(text) if word not in STOP_WORDS]
+
+
+class SearchIndex:
+    """Inverted index with BM25 ranking and clearance filtering"""
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[str, float]] = {}
+        self.lengths: Dict[str, float] = {}
+        self.documents: Dict[str, dict] = {}
+        self._terms: Dict[str, List[str]] = {}
+        self._total_length = 0.0
+        self._vocabulary: Optional[List[str]] = None
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def rebuild(self, objects: Iterable[dict]):
+        self.postings.clear()
+        self.lengths.clear()
+        self.documents.clear()
+        self._terms.clear()
+        self._total_length = 0.0
+        self._vocabulary = None
+        for obj in objects:
+            self.add(obj)
+
+    def add(self, obj: dict):
+        """Index an SCP object document, replacing any previous version"""
+        number = obj["number"]
+        self.remove(number)
+
+        frequencies: Dict[str, float] = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            for term in analyze(obj.get(field)):
+                frequencies[term] = frequencies.get(term, 0.0) + weight
+        for term, frequency in frequencies.items():
+            self.postings.setdefault(term, {})[number] = frequency
+
+        self._terms[number] = list(frequencies)
+        length = sum(frequencies.values())
+        self.lengths[number] = length
+        self._total_length += length
+        self.documents[number] = {
+            **{field: obj.get(field) for field in STORED_FIELDS},
+            "required_clearance": get_required_clearance(obj.get("threat_class", "")),
+        }
+        self._vocabulary = None
+
+    def remove(self, number: str) -> bool:
+        if number not in self.documents:
+            return False
+        for term in self._terms.pop(number):
+            documents = self.postings[term]
+            del documents[number]
+            if not documents:
+                del self.postings[term]
+        self._total_length -= self.lengths.pop(number)
+        del self.documents[number]
+        self._vocabulary = None
+        return True
+
+    def _expand_prefix(self, prefix: str) -> List[str]:
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self.postings)
+        start = bisect.bisect_left(self._vocabulary, prefix)
+        terms = []
+        for term in self._vocabulary[start:start + MAX_PREFIX_EXPANSIONS]:
+            if not term.startswith(prefix):
+                break
+            terms.append(term)
+        return terms
+
+    def _query_terms(self, query: str) -> Dict[str, float]:
+        words = [word for word in normalize(query) if word not in STOP_WORDS]
+        terms: Dict[str, float] = {}
+        for word in words:
+            terms[stem(word)] = 1.0
+        if words:
+            # The word being typed may be incomplete
+            last = words[-1]
+            for term in self._expand_prefix(last):
+                terms.setdefault(term, PREFIX_WEIGHT)
+        return terms
+
+    def search(self, query: str, clearance_level: int, limit: int = 20) -> List[Tuple[float, dict]]:
+        """Best matching documents visible at a clearance level, highest score first"""
+        count = len(self.documents)
+        if not count:
+            return []
+        average_length = self._total_length / count or 1.0
+
+        scores: Dict[str, float] = {}
+        for term, query_weight in self._query_terms(query).items():
+            documents = self.postings.get(term)
+            if not documents:
+                continue
+            idf = math.log(1 + (count - len(documents) + 0.5) / (len(documents) + 0.5))
+            for number, frequency in documents.items():
+                if self.documents[number]["required_clearance"] > clearance_level:
+                    continue
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[number] / average_length)
+                scores[number] = scores.get(number, 0.0) + query_weight * idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+        return [(score, self.documents[number]) for number, score in ranked]
+
+
+def snippet(text: Optional[str], query: str, width: int = 160) -> str:
+    """A window of text around the first word sharing a stem with the query"""
+    if not text:
+        return ""
+    stems = {stem(word) for word in normalize(query)}
+    position = 0
+    for match in WORD_RE.finditer(text.lower().replace("ё", "е")):
+        if stem(match.group()) in stems:
+            position = match.start()
+            break
+    start = max(0, position - width // 4)
+    end = min(len(text), start + width)
+    return ("…" if start else "") + text[start:end].strip() + ("…" if end < len(text) else "")
@@ -1,52 +1,276 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, APIRouter, Request, HTTPException, Depends, Header, Query, WebSocket, WebSocketDisconnect
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.encoders import jsonable_encoder
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from starlette.responses import Response, StreamingResponse
 import os
+import re
+import hmac
+import json
+import time
+import base64
+import asyncio
 import logging
+import threading
+import collections
 from pathlib import Path
-from typing import List, Optional
-from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+from pydantic import TypeAdapter
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+from datetime import datetime, timedelta, timezone
 
 # Import local modules
 from models import (
-    User, UserCreate, UserLogin, UserResponse, TokenResponse,
-    SCPObject, SCPObjectCreate, SCPObjectUpdate,
+    User, UserCreate, UserLogin, UserResponse, UserPage, TokenResponse,
+    SCPObject, SCPObjectCreate, SCPObjectUpdate, SCPSearchHit, SCPChanges,
     ChatMessage, ChatRequest, ChatResponse,
+    BulkUserFilter, BulkClearanceUpdate, BulkStatusUpdate,
     get_required_clearance
 )
 from auth_utils import hash_password, verify_password, create_access_token, decode_access_token
-from scp_data import SCP_OBJECTS_DATA
-from emergentintegrations.llm.chat import LlmChat, UserMessage
 from fallback_responses import get_fallback_response
+from llm_providers import create_provider_from_env
+from pubsub import PubSub, create_backend
+from cache import TTLCache, MISSING
+from invalidation import InvalidationBus
+from singleflight import SingleFlight
+from session_queue import SessionQueue
+from jobs import JobRunner, track_jobs
+from ids import new_ulid
+import metrics
+import logging_setup
+from profiling import CaptureStore, StackSampler, ProfilingMiddleware
+from compression import CompressionMiddleware, DefaultJSONResponse, PrecompressedPayload
+import retention
+import catalog_versions
+import bulk_io
+from search_index import SearchIndex, snippet
+from retrieval import CatalogRetriever, context_block
+from ratelimit import RateLimiter, create_store, client_ip, retry_after_header
+from admission import AdmissionMiddleware, LoopLagMonitor, CRITICAL, NORMAL, LOW
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
-
-# Create the main app without a prefix
-app = FastAPI()
+# MongoDB connection, established by the app lifespan (see connect_database)
+client = None
+db = None
+# Bulk exports may go to secondaries (MONGO_READ_PREFERENCE). Cache fills and
+# chat history stay on the primary: a lagging secondary would re-cache stale
+# data after an invalidation, or hide the message a user just sent
+read_db = None
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
 # LLM configuration
-EMERGENT_LLM_KEY = os.environ.get('EMERGENT_LLM_KEY')
+llm_provider = create_provider_from_env()
+LLM_TIMEOUT_SECONDS = float(os.environ.get('LLM_TIMEOUT_SECONDS', '60'))
+
+# Persistent chat connections: server ping interval, idle cutoff and messages waiting for a turn
+CHAT_WS_HEARTBEAT_S = float(os.environ.get('CHAT_WS_HEARTBEAT_S', '25'))
+CHAT_WS_IDLE_TIMEOUT_S = float(os.environ.get('CHAT_WS_IDLE_TIMEOUT_S', '300'))
+CHAT_WS_MAX_QUEUED = int(os.environ.get('CHAT_WS_MAX_QUEUED', '10'))
+CHAT_HISTORY_WINDOW = 50
+
+# Chat turns run one at a time per session; CHAT_COALESCE_MS > 0 answers
+# messages sent in quick succession with one completion
+chat_queue = SessionQueue(
+    float(os.environ.get('CHAT_COALESCE_MS', '0')) / 1000,
+    int(os.environ.get('CHAT_COALESCE_MAX', '5')),
+    float(os.environ.get('CHAT_IDEMPOTENCY_TTL', '600'))
+)
+metrics.track_cache(chat_queue.results)
+metrics.track_singleflight(chat_queue.flight)
+
+# Pub/sub for server-pushed notifications; the backend is chosen on startup
+pubsub = PubSub()
+
+# Authenticated principals, keyed by user id
+principal_cache = metrics.track_cache(
+    TTLCache("principal", float(os.environ.get('PRINCIPAL_CACHE_TTL', '30')))
+)
+
+# Full SCP catalog, as stored
+catalog_cache = metrics.track_cache(
+    TTLCache("catalog", float(os.environ.get('CATALOG_CACHE_TTL', '300')), maxsize=1)
+)
+
+# Full-text index over the catalog, built on startup
+search_index = SearchIndex()
+SEARCH_SECONDS = metrics.histogram(
+    "scp_search_duration_seconds", "Time spent ranking catalog search results",
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05)
+)
+
+# Catalog passages injected into MAL0's prompt
+catalog_retriever = CatalogRetriever(
+    search_index,
+    top_k=int(os.environ.get('RAG_TOP_K', '3')),
+    token_budget=int(os.environ.get('RAG_TOKEN_BUDGET', '600')),
+    min_score=float(os.environ.get('RAG_MIN_SCORE', '0.5'))
+)
+
+# Serialized /api/scp responses per clearance level, precompressed
+catalog_payload_cache = metrics.track_cache(
+    TTLCache("catalog_payload", float(os.environ.get('CATALOG_CACHE_TTL', '300')), maxsize=8)
+)
+SCP_OBJECT_LIST = TypeAdapter(List[SCPObject])
+
+# Single objects by number; None marks numbers known not to exist
+scp_object_cache = metrics.track_cache(
+    TTLCache("scp_object", float(os.environ.get('SCP_OBJECT_CACHE_TTL', '300')))
+)
+SCP_OBJECT_NEGATIVE_HITS = metrics.counter(
+    "scp_object_negative_hits_total", "Object lookups answered 404 from the negative cache"
+)
+
+# Concurrent misses for the same key share one database load
+flights = {
+    name: metrics.track_singleflight(SingleFlight(name))
+    for name in ("principal", "catalog", "catalog_payload", "scp_object")
+}
+
+# Keeps the caches above coherent across workers
+invalidation_bus = InvalidationBus(pubsub)
+invalidation_bus.register(principal_cache)
+invalidation_bus.register(catalog_cache)
+invalidation_bus.register(scp_object_cache)
+
+@invalidation_bus.on_invalidate
+def forget_stale_loads(cache_name, keys):
+    # Loads that started before an invalidation must not be joined or stored
+    flight = flights.get(cache_name)
+    if flight:
+        flight.forget(keys)
+
+@invalidation_bus.on_invalidate
+def drop_catalog_payloads(cache_name, keys):
+    # Payloads are derived from the catalog, so they go with it
+    if cache_name == "catalog":
+        catalog_payload_cache.clear()
+        flights["catalog_payload"].forget()
+
+def index_scp_object(obj: dict):
+    """Add or replace an object in the search index and the retrieval passages"""
+    search_index.add(obj)
+    catalog_retriever.add(obj)
+
+def unindex_scp_object(number: str):
+    search_index.remove(number)
+    catalog_retriever.remove(number)
+
+async def refresh_search_index(numbers: Optional[list]):
+    """Re-index changed objects from the database; None re-indexes everything"""
+    if numbers is None:
+        objects = await db.scp_objects.find({}, {"_id": 0}).to_list(None)
+        search_index.rebuild(objects)
+        catalog_retriever.rebuild(objects)
+        return
+    for number in numbers:
+        obj = await db.scp_objects.find_one({"number": number}, {"_id": 0})
+        if obj:
+            index_scp_object(obj)
+        else:
+            unindex_scp_object(number)
+
+_search_refreshes = set()
+
+@invalidation_bus.on_invalidate
+def schedule_search_refresh(cache_name, keys):
+    # Writes in other workers arrive as scp_object invalidations keyed by number
+    if cache_name == "scp_object":
+        task = asyncio.create_task(refresh_search_index(keys))
+        _search_refreshes.add(task)
+        task.add_done_callback(_search_refreshes.discard)
+
+# Idle authenticated chat sessions are rolled into archives; the database is attached on startup
+chat_compactor = retention.ChatCompactor(
+    None,
+    timedelta(hours=float(os.environ.get('CHAT_ARCHIVE_AFTER_HOURS', '72'))),
+    float(os.environ.get('CHAT_COMPACTION_INTERVAL_S', '3600'))
+)
+
+# Token buckets for chat and login; the shared store is chosen on startup
+RATE_LIMIT_STORE = os.environ.get('RATE_LIMIT_STORE', 'local')
+RATE_LIMIT_TRUST_FORWARDED = os.environ.get('RATE_LIMIT_TRUST_FORWARDED', 'false').lower() == 'true'
+chat_limiter = RateLimiter(
+    "chat",
+    float(os.environ.get('CHAT_RATE_LIMIT_PER_MIN', '20')),
+    float(os.environ.get('CHAT_RATE_LIMIT_BURST', '10'))
+)
+chat_session_limiter = RateLimiter(
+    "chat_session",
+    float(os.environ.get('CHAT_SESSION_RATE_LIMIT_PER_MIN', '20')),
+    float(os.environ.get('CHAT_SESSION_RATE_LIMIT_BURST', '10'))
+)
+login_limiter = RateLimiter(
+    "login",
+    float(os.environ.get('LOGIN_RATE_LIMIT_PER_MIN', '10')),
+    float(os.environ.get('LOGIN_RATE_LIMIT_BURST', '5'))
+)
+login_account_limiter = RateLimiter(
+    "login_account",
+    float(os.environ.get('LOGIN_ACCOUNT_RATE_LIMIT_PER_MIN', '10')),
+    float(os.environ.get('LOGIN_ACCOUNT_RATE_LIMIT_BURST', '5'))
+)
+RATE_LIMITERS = (chat_limiter, chat_session_limiter, login_limiter, login_account_limiter)
+
+# Side effects finished after the response: assistant messages and dossier notifications
+job_runner = track_jobs(JobRunner(float(os.environ.get('JOBS_DRAIN_TIMEOUT_S', '10'))))
+for job_queue in ("chat", "notify"):
+    job_runner.add_queue(
+        job_queue,
+        maxsize=int(os.environ.get('JOBS_QUEUE_SIZE', '1000')),
+        workers=int(os.environ.get('JOBS_WORKERS', '2')),
+        max_attempts=int(os.environ.get('JOBS_MAX_ATTEMPTS', '3'))
+    )
+
+# Admission control: shed low-priority traffic while the event loop lags
+loop_monitor = LoopLagMonitor(
+    float(os.environ.get('LOOP_LAG_PROBE_MS', '50')) / 1000,
+    int(os.environ.get('LOOP_LAG_SUSTAIN_PROBES', '3'))
+)
+ADMISSION_LAG_MS = float(os.environ.get('ADMISSION_LAG_MS', '200'))
+ADMISSION_SEVERE_LAG_MS = float(os.environ.get('ADMISSION_SEVERE_LAG_MS', '0'))
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get('ADMISSION_MAX_IN_FLIGHT', '0'))
+ADMISSION_RETRY_AFTER_S = float(os.environ.get('ADMISSION_RETRY_AFTER_S', '2'))
+
+# Chat metrics
+LLM_REQUEST_SECONDS = metrics.histogram(
+    "llm_request_duration_seconds", "Latency of LLM completions", ["provider", "model", "outcome"]
+)
+FALLBACK_RESPONSE_SECONDS = metrics.histogram(
+    "fallback_response_duration_seconds", "Time spent generating local fallback responses"
+)
+CHAT_RESPONSES_TOTAL = metrics.counter(
+    "chat_responses_total", "Chat responses by mode and fallback reason", ["mode", "reason"]
+)
+
+# /metrics is readable with this static bearer token (for scrapers) or by clearance 5 users
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Profiling: slow-request capture is enabled by setting PROFILE_SLOW_MS
+PROFILE_SLOW_MS = float(os.environ.get('PROFILE_SLOW_MS', '0'))
+profile_store = CaptureStore(
+    Path(os.environ.get('PROFILE_DIR', ROOT_DIR / 'profiles')),
+    int(os.environ.get('PROFILE_MAX_CAPTURES', '50'))
+)
+stack_sampler = StackSampler(
+    float(os.environ.get('PROFILE_SAMPLE_INTERVAL_MS', '5')) / 1000
+) if PROFILE_SLOW_MS > 0 else None
 
 # Security
 security = HTTPBearer(auto_error=False)
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Configure logging: records are queued and written by a background thread
+logging_setup.configure_from_env()
 logger = logging.getLogger(__name__)
+# Per-turn chat lines, on their own logger so they can be sampled
+chat_logger = logging.getLogger(f"{__name__}.chat")
 
 # Dependency to get current user from token
 async def get_current_user(
@@ -66,8 +290,23 @@ async def get_current_user(
     if not user_id:
         return None
     
-    user = await db.users.find_one({"id": user_id}, {"_id": 0, "password_hash": 0})
-    return user
+    return await flights["principal"].cached(
+        principal_cache,
+        user_id,
+        lambda: db.users.find_one({"id": user_id}, {"_id": 0, "password_hash": 0})
+    )
+
+async def get_websocket_user(websocket: WebSocket) -> Optional[dict]:
+    """Get current user from a WebSocket's bearer header or ?token= query parameter"""
+    token = websocket.query_params.get("token")
+    if not token:
+        auth_header = websocket.headers.get("authorization", "")
+        if auth_header.lower().startswith("bearer "):
+            token = auth_header[7:]
+    if not token:
+        return None
+    
+    return await get_current_user(HTTPAuthorizationCredentials(scheme="Bearer", credentials=token))
 
 async def require_auth(
     current_user: Optional[dict] = Depends(get_current_user)
@@ -77,6 +316,59 @@ async def require_auth(
         raise HTTPException(status_code=401, detail="Not authenticated")
     return current_user
 
+async def authorize_profiling(authorization: str) -> bool:
+    """Allow per-request profiling only for clearance level 5 users"""
+    if not authorization.lower().startswith("bearer "):
+        return False
+    user = await get_current_user(HTTPAuthorizationCredentials(scheme="Bearer", credentials=authorization[7:]))
+    return bool(user) and user["clearance_level"] >= 5
+
+def request_ip(request: Request) -> str:
+    """Client address used as the rate limit key for anonymous callers"""
+    return client_ip(request.client, request.headers.get("x-forwarded-for"), RATE_LIMIT_TRUST_FORWARDED)
+
+async def enforce_rate_limits(*checks):
+    """Take a token from each (limiter, key) bucket; 429 on the first empty one.
+    
+    Tokens already taken from earlier buckets are given back on a 429, so a
+    rejected request costs nothing.
+    """
+    for taken, (limiter, key) in enumerate(checks):
+        retry_after = await limiter.hit(key)
+        if retry_after:
+            for earlier, earlier_key in checks[:taken]:
+                await earlier.refund(earlier_key)
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests",
+                headers={"Retry-After": retry_after_header(retry_after)}
+            )
+
+# Polling endpoints clients call on a timer; a late answer costs them nothing
+POLLING_ROUTES = re.compile(r"^/api/(scp|scp/search|scp/changes|dossier/status|dossier/my-submissions|chat/history/[^/]+)$")
+
+def request_priority(scope) -> str:
+    """Admission priority of a request; only consulted while the server is overloaded"""
+    path = scope["path"]
+    if path.startswith(("/api/auth/", "/api/admin/")):
+        return CRITICAL
+    # Only a valid token of a recently seen user counts; no database lookups here
+    principal = None
+    authorization = dict(scope["headers"]).get(b"authorization", b"").decode("latin-1")
+    if authorization.lower().startswith("bearer "):
+        payload = decode_access_token(authorization[7:])
+        if payload:
+            cached = principal_cache.get(payload.get("sub"))
+            principal = None if cached is MISSING else cached
+    if principal and principal["clearance_level"] >= 5:
+        return CRITICAL
+    if path == "/api/chat" and not principal:
+        # Anonymous chat is the cheapest traffic to turn away
+        return LOW
+    if scope["method"] == "GET" and POLLING_ROUTES.match(path):
+        return LOW
+    return NORMAL
+
 def require_clearance(min_level: int):
     """Require minimum clearance level"""
     async def clearance_checker(current_user: dict = Depends(require_auth)):
@@ -89,40 +381,119 @@ def require_clearance(min_level: int):
     return clearance_checker
 
 # Initialize database
+async def ensure_indexes():
+    """Create indexes used by the hot query paths"""
+    await db.users.create_index("id")
+    await db.scp_objects.create_index("number", unique=True)
+    await db.users.create_index([("username_key", 1), ("id", 1)])
+    await db.users.create_index([("clearance_level", 1), ("username_key", 1), ("id", 1)])
+    await db.chat_messages.create_index([("session_id", 1), ("timestamp", 1), ("id", 1)])
+    await db.chat_messages.create_index([("session_id", 1), ("id", 1)])
+    await db.dossier_submissions.create_index([("user_id", 1), ("submitted_at", -1)])
+    await db.dossier_submissions.create_index([("submitted_at", -1)])
+    await retention.ensure_indexes(db)
+    await catalog_versions.ensure_indexes(db)
+
+def username_key(username: str) -> str:
+    """Case-folded username the user directory is searched and ordered by"""
+    return username.lower()
+
+async def backfill_username_keys() -> int:
+    """Give users created before directory search a username_key"""
+    count = 0
+    async for user in db.users.find({"username_key": {"$exists": False}}, {"_id": 0, "id": 1, "username": 1}):
+        await db.users.update_one({"id": user["id"]}, {"$set": {"username_key": username_key(user["username"])}})
+        count += 1
+    return count
+
 async def initialize_database():
     """Initialize SCP objects and create admin user if not exists"""
     
+    await ensure_indexes()
+    
     # Initialize SCP objects
     existing_count = await db.scp_objects.count_documents({})
     if existing_count == 0:
+        from scp_data import SCP_OBJECTS_DATA
+        
         for obj_data in SCP_OBJECTS_DATA:
-            obj_data["created_at"] = datetime.now(timezone.utc).isoformat()
+            obj_data["created_at"] = datetime.now(timezone.utc)
             await db.scp_objects.insert_one(obj_data)
         logger.info(f"Initialized SCP database with {len(SCP_OBJECTS_DATA)} objects")
     else:
         logger.info(f"SCP database already initialized with {existing_count} objects")
     
+    backfilled = await catalog_versions.backfill(db)
+    if backfilled:
+        logger.info(f"Assigned catalog versions to {backfilled} objects")
+    
+    classified = await catalog_versions.backfill_clearance(db)
+    if classified:
+        logger.info(f"Started clearance history of {classified} objects")
+    
+    keyed = await backfill_username_keys()
+    if keyed:
+        logger.info(f"Assigned directory keys to {keyed} users")
+    
+    sessions = await retention.backfill_sessions(db)
+    if sessions:
+        logger.info(f"Recorded activity of {sessions} existing chat sessions")
+    
     # Create admin user if not exists
     admin = await db.users.find_one({"username": "admin"})
     if not admin:
         admin_user = {
             "id": "admin-000",
             "username": "admin",
-            "password_hash": hash_password("admin123"),
+            "username_key": "admin",
+            "password_hash": await asyncio.to_thread(hash_password, "admin123"),
             "clearance_level": 5,
-            "created_at": datetime.now(timezone.utc).isoformat(),
+            "created_at": datetime.now(timezone.utc),
             "is_active": True,
             "is_admin": True  # Special flag for admin
         }
         await db.users.insert_one(admin_user)
         logger.info("Created default admin user (username: admin, password: admin123)")
 
-@app.on_event("startup")
-async def startup_event():
-    await initialize_database()
+async def connect_database():
+    """Create the Mongo client; runs on startup so importing the app stays cheap"""
+    global client, db, read_db
+    import database
+    
+    client = database.create_client(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    read_db = database.read_mostly_database(client, os.environ['DB_NAME'])
 
-@app.on_event("shutdown")
-async def shutdown_event():
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await connect_database()
+    pubsub.backend = create_backend(os.environ.get('PUBSUB_BACKEND', 'local'), db)
+    if RATE_LIMIT_STORE != "local":
+        store = create_store(RATE_LIMIT_STORE, db)
+        await store.ensure_indexes()
+        for limiter in RATE_LIMITERS:
+            limiter.store = store
+    await initialize_database()
+    await refresh_search_index(None)
+    await pubsub.start()
+    invalidation_bus.start()
+    chat_compactor.db = db
+    chat_compactor.start()
+    job_runner.start()
+    loop_monitor.start()
+    if stack_sampler:
+        stack_sampler.start(threading.get_ident())
+    
+    yield
+    
+    # Queued side effects still need the database and pub/sub
+    await job_runner.drain()
+    await loop_monitor.stop()
+    if stack_sampler:
+        stack_sampler.stop()
+    await chat_compactor.stop()
+    await invalidation_bus.stop()
+    await pubsub.stop()
     client.close()
 
 # ============ DOSSIER SUBMISSION ROUTES ============
@@ -162,8 +533,6 @@ async def submit_dossier(
     )
     
     dossier_dict = dossier.model_dump()
-    dossier_dict["submitted_at"] = dossier_dict["submitted_at"].isoformat()
-    
     await db.dossier_submissions.insert_one(dossier_dict)
     
     logger.info(f"Dossier submitted by user {current_user['username']} ({current_user['id']})")
@@ -183,13 +552,6 @@ async def get_my_dossier_submissions(
         {"_id": 0, "file_data": 0}  # Exclude file_data from response for performance
     ).sort("submitted_at", -1).to_list(100)
     
-    # Parse dates
-    for submission in submissions:
-        if isinstance(submission.get("submitted_at"), str):
-            submission["submitted_at"] = submission["submitted_at"]
-        if submission.get("reviewed_at") and isinstance(submission["reviewed_at"], str):
-            submission["reviewed_at"] = submission["reviewed_at"]
-    
     return submissions
 
 @api_router.get("/dossier/status")
@@ -206,17 +568,48 @@ async def get_dossier_status(
     if not submission:
         return {"has_submission": False}
     
-    # Parse dates
-    if isinstance(submission.get("submitted_at"), str):
-        submission["submitted_at"] = submission["submitted_at"]
-    if submission.get("reviewed_at") and isinstance(submission["reviewed_at"], str):
-        submission["reviewed_at"] = submission["reviewed_at"]
-    
     return {
         "has_submission": True,
         "submission": submission
     }
 
+@api_router.websocket("/dossier/ws")
+async def dossier_status_ws(websocket: WebSocket):
+    """Push dossier status changes to the submitting user instead of polling /dossier/status"""
+    current_user = await get_websocket_user(websocket)
+    if not current_user:
+        await websocket.close(code=4401)
+        return
+    
+    await websocket.accept()
+    
+    with pubsub.subscribe(f"dossier:{current_user['id']}") as subscription:
+        # Send the current state once so the client does not need an initial poll
+        snapshot = await get_dossier_status(current_user)
+        await websocket.send_json(jsonable_encoder({"type": "snapshot", **snapshot}))
+        
+        receiver = asyncio.create_task(websocket.receive_text())
+        event = None
+        try:
+            while True:
+                event = asyncio.create_task(subscription.get())
+                done, _ = await asyncio.wait({receiver, event}, return_when=asyncio.FIRST_COMPLETED)
+                # Deliver a notification even if the client spoke at the same moment
+                if event in done:
+                    await websocket.send_json(jsonable_encoder(event.result()))
+                else:
+                    event.cancel()
+                if receiver in done:
+                    # Clients only talk to keep the connection alive
+                    receiver.result()
+                    receiver = asyncio.create_task(websocket.receive_text())
+        except WebSocketDisconnect:
+            pass
+        finally:
+            receiver.cancel()
+            if event:
+                event.cancel()
+
 @api_router.get("/admin/dossiers")
 async def get_all_dossier_submissions(
     current_user: dict = Depends(require_clearance(5))
@@ -227,13 +620,6 @@ async def get_all_dossier_submissions(
         {"_id": 0, "file_data": 0}  # Exclude file_data for performance
     ).sort("submitted_at", -1).to_list(1000)
     
-    # Parse dates
-    for submission in submissions:
-        if isinstance(submission.get("submitted_at"), str):
-            submission["submitted_at"] = submission["submitted_at"]
-        if submission.get("reviewed_at") and isinstance(submission["reviewed_at"], str):
-            submission["reviewed_at"] = submission["reviewed_at"]
-    
     return submissions
 
 @api_router.get("/admin/dossiers/{dossier_id}")
@@ -250,12 +636,6 @@ async def get_dossier_detail(
     if not submission:
         raise HTTPException(status_code=404, detail="Dossier not found")
     
-    # Parse dates
-    if isinstance(submission.get("submitted_at"), str):
-        submission["submitted_at"] = submission["submitted_at"]
-    if submission.get("reviewed_at") and isinstance(submission["reviewed_at"], str):
-        submission["reviewed_at"] = submission["reviewed_at"]
-    
     return submission
 
 @api_router.put("/admin/dossiers/{dossier_id}/moderate")
@@ -278,7 +658,7 @@ async def moderate_dossier(
     # Update dossier
     update_data = {
         "status": status,
-        "reviewed_at": datetime.now(timezone.utc).isoformat(),
+        "reviewed_at": datetime.now(timezone.utc),
         "reviewed_by": current_user["username"],
         "admin_comment": moderation.get("admin_comment", "")
     }
@@ -290,6 +670,12 @@ async def moderate_dossier(
     
     logger.info(f"Dossier {dossier_id} {status} by admin {current_user['username']}")
     
+    await job_runner.submit("notify", pubsub.publish, f"dossier:{dossier['user_id']}", {
+        "type": "dossier_status",
+        "dossier_id": dossier_id,
+        **update_data
+    })
+    
     return {
         "message": f"Досье {status}",
         "dossier_id": dossier_id
@@ -321,13 +707,13 @@ async def register(user_data: UserCreate):
     # Create user
     user = User(
         username=user_data.username,
-        password_hash=hash_password(user_data.password),
+        password_hash=await asyncio.to_thread(hash_password, user_data.password),
         clearance_level=clearance_level
     )
     
     user_dict = user.model_dump()
-    user_dict["created_at"] = user_dict["created_at"].isoformat()
     user_dict["is_admin"] = False  # Regular users are not admins
+    user_dict["username_key"] = username_key(user.username)
     await db.users.insert_one(user_dict)
     
     # Create token
@@ -348,11 +734,18 @@ async def register(user_data: UserCreate):
     )
 
 @api_router.post("/auth/login", response_model=TokenResponse)
-async def login(credentials: UserLogin):
+async def login(credentials: UserLogin, http_request: Request):
     """Login user"""
+    # Throttle before bcrypt so brute force cannot pin the workers. The
+    # account bucket is per client too, so others cannot lock a user out
+    ip = request_ip(http_request)
+    await enforce_rate_limits(
+        (login_limiter, ip),
+        (login_account_limiter, f"{credentials.username.lower()}|{ip}")
+    )
     user = await db.users.find_one({"username": credentials.username}, {"_id": 0})
     
-    if not user or not verify_password(credentials.password, user["password_hash"]):
+    if not user or not await asyncio.to_thread(verify_password, credentials.password, user["password_hash"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     if not user.get("is_active", True):
@@ -361,16 +754,11 @@ async def login(credentials: UserLogin):
     # Create token
     access_token = create_access_token({"sub": user["id"]})
     
-    # Parse created_at
-    created_at = user["created_at"]
-    if isinstance(created_at, str):
-        created_at = datetime.fromisoformat(created_at)
-    
     user_response = UserResponse(
         id=user["id"],
         username=user["username"],
         clearance_level=user["clearance_level"],
-        created_at=created_at,
+        created_at=user["created_at"],
         is_active=user["is_active"]
     )
     
@@ -383,52 +771,116 @@ async def login(credentials: UserLogin):
 @api_router.get("/auth/me", response_model=UserResponse)
 async def get_me(current_user: dict = Depends(require_auth)):
     """Get current user info"""
-    created_at = current_user["created_at"]
-    if isinstance(created_at, str):
-        created_at = datetime.fromisoformat(created_at)
-    
     return UserResponse(
         id=current_user["id"],
         username=current_user["username"],
         clearance_level=current_user["clearance_level"],
-        created_at=created_at,
+        created_at=current_user["created_at"],
         is_active=current_user["is_active"]
     )
 
 # ============ SCP OBJECT ROUTES ============
 
-@api_router.get("/scp", response_model=List[SCPObject])
-async def get_scp_objects(current_user: Optional[dict] = Depends(get_current_user)):
-    """Get SCP objects based on user clearance level"""
-    clearance_level = current_user["clearance_level"] if current_user else 1
-    
-    # Build query based on clearance
+async def load_catalog() -> list:
+    """Load all SCP objects, cached in-process until invalidated"""
+    return await flights["catalog"].cached(
+        catalog_cache,
+        "all",
+        lambda: db.scp_objects.find({}, {"_id": 0}).to_list(1000)
+    )
+
+def visible_catalog(all_objects: list, clearance_level: int) -> list:
+    """SCP objects a clearance level may see, secret data hidden below level 5"""
     objects = []
-    all_objects = await db.scp_objects.find({}, {"_id": 0}).to_list(1000)
-    
     for obj in all_objects:
         required_clearance = get_required_clearance(obj["threat_class"])
         
         # User can access if their clearance >= required
         if clearance_level >= required_clearance:
-            # For levels < 5, hide secret_data
+            # For levels < 5, hide secret_data (on a copy: cached documents are shared)
             if clearance_level < 5:
-                obj["secret_data"] = "[ТРЕБУЕТСЯ УРОВЕНЬ ДОПУСКА 5]"
-            
-            # Parse created_at
-            if isinstance(obj.get('created_at'), str):
-                obj['created_at'] = datetime.fromisoformat(obj['created_at'])
+                obj = {**obj, "secret_data": "[ТРЕБУЕТСЯ УРОВЕНЬ ДОПУСКА 5]"}
             
             objects.append(obj)
     
     return objects
 
+@api_router.get("/scp", response_model=List[SCPObject])
+async def get_scp_objects(request: Request, current_user: Optional[dict] = Depends(get_current_user)):
+    """Get SCP objects based on user clearance level"""
+    clearance_level = current_user["clearance_level"] if current_user else 1
+    
+    # Encoded and compressed once per clearance level until the catalog changes
+    async def build_payload():
+        objects = visible_catalog(await load_catalog(), clearance_level)
+        return PrecompressedPayload(SCP_OBJECT_LIST.dump_json(SCP_OBJECT_LIST.validate_python(objects)))
+    
+    payload = await flights["catalog_payload"].cached(catalog_payload_cache, clearance_level, build_payload)
+    
+    return payload.response(request.headers.get("accept-encoding", ""))
+
+@api_router.get("/scp/search", response_model=List[SCPSearchHit])
+async def search_scp_objects(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=50),
+    current_user: Optional[dict] = Depends(get_current_user)
+):
+    """Full-text search over the SCP objects visible at the user's clearance level"""
+    clearance_level = current_user["clearance_level"] if current_user else 1
+    
+    with SEARCH_SECONDS.time():
+        results = search_index.search(q, clearance_level, limit)
+    
+    return [
+        SCPSearchHit(
+            number=doc["number"],
+            name=doc["name"],
+            codename=doc["codename"],
+            threat_class=doc["threat_class"],
+            image_url=doc["image_url"],
+            score=round(score, 4),
+            snippet=snippet(doc["description"], q)
+        )
+        for score, doc in results
+    ]
+
+@api_router.get("/scp/changes", response_model=SCPChanges)
+async def get_scp_changes(
+    since: int = Query(0, ge=0),
+    current_user: Optional[dict] = Depends(get_current_user)
+):
+    """Objects changed and deleted after catalog version `since`, for offline clients"""
+    clearance_level = current_user["clearance_level"] if current_user else 1
+    
+    # Read from the primary: a lagging secondary could hide changes below the version
+    version, changed, tombstones = await catalog_versions.changes_since(db, since)
+    
+    visible = visible_catalog(changed, clearance_level)
+    visible_numbers = {obj["number"] for obj in visible}
+    # Objects moved out of the caller's clearance are deletions as far as the client is
+    # concerned, but only a client that could see them at `since` may learn their numbers
+    hidden = [obj for obj in changed if obj["number"] not in visible_numbers]
+    deleted = [
+        doc["number"] for doc in tombstones + hidden
+        if catalog_versions.was_visible(doc, since, clearance_level)
+    ]
+    
+    return {"version": version, "changed": visible, "deleted": deleted}
+
 @api_router.get("/scp/{number}", response_model=SCPObject)
 async def get_scp_object(number: str, current_user: Optional[dict] = Depends(get_current_user)):
     """Get specific SCP object by number"""
     clearance_level = current_user["clearance_level"] if current_user else 1
     
-    obj = await db.scp_objects.find_one({"number": number}, {"_id": 0})
+    obj = scp_object_cache.get(number)
+    if obj is None:
+        SCP_OBJECT_NEGATIVE_HITS.inc()
+    elif obj is MISSING:
+        obj = await flights["scp_object"].cached(
+            scp_object_cache,
+            number,
+            lambda: db.scp_objects.find_one({"number": number}, {"_id": 0})
+        )
     
     if not obj:
         raise HTTPException(status_code=404, detail="Object not found")
@@ -438,13 +890,9 @@ async def get_scp_object(number: str, current_user: Optional[dict] = Depends(get
     if clearance_level < required_clearance:
         raise HTTPException(status_code=403, detail="Insufficient clearance level")
     
-    # Hide secret data for levels < 5
+    # Hide secret data for levels < 5 (on a copy: cached documents are shared)
     if clearance_level < 5:
-        obj["secret_data"] = "[ТРЕБУЕТСЯ УРОВЕНЬ ДОПУСКА 5]"
-    
-    # Parse created_at
-    if isinstance(obj.get('created_at'), str):
-        obj['created_at'] = datetime.fromisoformat(obj['created_at'])
+        obj = {**obj, "secret_data": "[ТРЕБУЕТСЯ УРОВЕНЬ ДОПУСКА 5]"}
     
     return obj
 
@@ -459,11 +907,15 @@ async def create_scp_object(
     if existing:
         raise HTTPException(status_code=400, detail="Object with this number already exists")
     
-    obj = SCPObject(**obj_data.model_dump())
-    obj_dict = obj.model_dump()
-    obj_dict["created_at"] = obj_dict["created_at"].isoformat()
-    
-    await db.scp_objects.insert_one(obj_dict)
+    async with catalog_versions.stamp(db) as fields:
+        obj = SCPObject(**obj_data.model_dump(), **fields)
+        obj_dict = obj.model_dump()
+        obj_dict["clearance_history"] = [catalog_versions.clearance_entry(obj.version, obj.threat_class)]
+        await db.scp_objects.insert_one(obj_dict)
+    await catalog_versions.clear_tombstone(db, obj.number)
+    index_scp_object(obj_dict)
+    await invalidation_bus.invalidate("catalog")
+    await invalidation_bus.invalidate("scp_object", [obj.number])
     
     return obj
 
@@ -482,13 +934,19 @@ async def update_scp_object(
     update_data = {k: v for k, v in obj_data.model_dump().items() if v is not None}
     
     if update_data:
-        await db.scp_objects.update_one({"number": number}, {"$set": update_data})
+        async with catalog_versions.stamp(db) as fields:
+            update = {"$set": {**update_data, **fields}}
+            threat_class = update_data.get("threat_class")
+            if threat_class and get_required_clearance(threat_class) != get_required_clearance(existing["threat_class"]):
+                update["$push"] = {"clearance_history": catalog_versions.clearance_entry(fields["version"], threat_class)}
+            await db.scp_objects.update_one({"number": number}, update)
+        await invalidation_bus.invalidate("catalog")
+        await invalidation_bus.invalidate("scp_object", [number])
     
     # Get updated object
     updated = await db.scp_objects.find_one({"number": number}, {"_id": 0})
-    
-    if isinstance(updated.get('created_at'), str):
-        updated['created_at'] = datetime.fromisoformat(updated['created_at'])
+    if updated:
+        index_scp_object(updated)
     
     return updated
 
@@ -498,11 +956,19 @@ async def delete_scp_object(
     current_user: dict = Depends(require_clearance(5))
 ):
     """Delete SCP object (Admin only)"""
-    result = await db.scp_objects.delete_one({"number": number})
+    deleted = await db.scp_objects.find_one_and_delete(
+        {"number": number},
+        {"_id": 0, "number": 1, "clearance_history": 1}
+    )
     
-    if result.deleted_count == 0:
+    if deleted is None:
         raise HTTPException(status_code=404, detail="Object not found")
     
+    await catalog_versions.record_delete(db, deleted)
+    unindex_scp_object(number)
+    await invalidation_bus.invalidate("catalog")
+    await invalidation_bus.invalidate("scp_object", [number])
+    
     return {"message": "Object deleted successfully"}
 
 # ============ CHAT ROUTES ============
@@ -542,32 +1008,8 @@ def detect_emotion_from_text(text: str) -> str:
     else:
         return 'calm'
 
-@api_router.post("/chat", response_model=ChatResponse)
-async def chat_with_mal0(request: ChatRequest, current_user: Optional[dict] = Depends(get_current_user)):
-    """Chat with MAL0 assistant - Enhanced with personality and clearance awareness"""
-    
-    # Store user message
-    user_message_doc = {
-        "id": str(datetime.now(timezone.utc).timestamp()),
-        "session_id": request.session_id,
-        "user_id": current_user["id"] if current_user else None,
-        "role": "user",
-        "content": request.message,
-        "timestamp": datetime.now(timezone.utc).isoformat()
-    }
-    await db.chat_messages.insert_one(user_message_doc)
-    
-    # Get conversation history
-    history = await db.chat_messages.find(
-        {"session_id": request.session_id},
-        {"_id": 0}
-    ).sort("timestamp", 1).limit(50).to_list(50)
-    
-    # Get user info for personalization
-    user_name = current_user["username"] if current_user else "Гость"
-    clearance_level = current_user["clearance_level"] if current_user else 1
-    is_executioner = user_name.lower() == "admin" and clearance_level == 5
-    
+def build_personality(user_name: str, clearance_level: int, is_executioner: bool) -> str:
+    """MAL0's system prompt for a user, before catalog context is added"""
     # Clearance level descriptions
     clearance_desc = {
         1: "Уровень 1 - Базовый",
@@ -651,136 +1093,613 @@ async def chat_with_mal0(request: ChatRequest, current_user: Optional[dict] = De
 
 Отвечай на русском языке в женском роде, показывая живую личность с эмоциями и сознанием."""
     
-    # Flag to track if we're in fallback mode
-    using_fallback = False
+    return personality
+
+def chat_persona(current_user: Optional[dict]) -> dict:
+    """Who MAL0 is talking to, as used for prompts and fallback responses"""
+    user_name = current_user["username"] if current_user else "Гость"
+    clearance_level = current_user["clearance_level"] if current_user else 1
+    is_executioner = user_name.lower() == "admin" and clearance_level == 5
+    return {
+        "user_name": user_name,
+        "clearance_level": clearance_level,
+        "is_executioner": is_executioner,
+        "personality": build_personality(user_name, clearance_level, is_executioner),
+    }
+
+def chat_message(session_id: str, user_id: Optional[str], role: str, content: str, **fields) -> dict:
+    """A new chat message document"""
+    return retention.with_expiry({
+        "id": new_ulid(),
+        "session_id": session_id,
+        "user_id": user_id,
+        "role": role,
+        "content": content,
+        **fields,
+        "timestamp": datetime.now(timezone.utc)
+    })
+
+async def persist_chat_message(message_doc: dict):
+    """Write a chat message; safe to retry, the id is fixed"""
+    await db.chat_messages.replace_one(
+        {"session_id": message_doc["session_id"], "id": message_doc["id"]},
+        dict(message_doc),
+        upsert=True
+    )
+    await retention.touch_session(db, message_doc)
+
+# Assistant replies queued for persistence and not yet written, by session
+unsaved_replies: Dict[str, Dict[str, dict]] = {}
+
+def forget_reply(message_doc: dict):
+    pending = unsaved_replies.get(message_doc["session_id"])
+    if pending is not None:
+        pending.pop(message_doc["id"], None)
+        if not pending:
+            del unsaved_replies[message_doc["session_id"]]
+
+async def persist_reply(message_doc: dict):
+    """Background write of a reply from store_reply, unless a reader already flushed it"""
+    if message_doc["id"] not in unsaved_replies.get(message_doc["session_id"], {}):
+        return
+    await persist_chat_message(message_doc)
+    forget_reply(message_doc)
+
+async def flush_replies(session_id: str):
+    """Write a session's queued replies now, so the history read that follows sees them"""
+    for message_doc in list(unsaved_replies.get(session_id, {}).values()):
+        await persist_chat_message(message_doc)
+        forget_reply(message_doc)
+
+async def store_chat_message(session_id: str, user_id: Optional[str], role: str, content: str, **fields) -> dict:
+    """Persist one chat message and return its document"""
+    message_doc = chat_message(session_id, user_id, role, content, **fields)
+    await db.chat_messages.insert_one(dict(message_doc))
+    await retention.touch_session(db, message_doc)
+    return message_doc
+
+def classify_llm_error(api_error: Exception) -> tuple:
+    """(fallback reason, fallback category) for a failed LLM call"""
+    error_str = str(api_error).lower()
+    
+    # Determine if it's a timeout or a rate limit/credit error
+    if isinstance(api_error, asyncio.TimeoutError):
+        logger.warning("API timed out - entering fallback mode")
+        return "API timeout", "timeout"
+    if any(keyword in error_str for keyword in ['rate limit', 'insufficient', 'quota', 'credit', '429', '402', 'billing']):
+        logger.warning(f"API credits exhausted or rate limited - entering fallback mode: {api_error}")
+        return "API rate limit or insufficient credits", "rate_limit"
+    logger.warning(f"API error - entering fallback mode: {api_error}")
+    return f"API error: {str(api_error)[:100]}", "api_error"
+
+async def generate_reply(
+    session_id: str,
+    message: str,
+    persona: dict,
+    conversation_length: int,
+    on_token: Optional[Callable[[str], Awaitable[None]]] = None
+) -> dict:
+    """Produce MAL0's reply through the LLM, or locally when it is unavailable.
+    
+    Tokens are passed to on_token as they arrive. The returned dict holds
+    the final response, emotion and fallback fields; after a fallback the
+    response replaces anything already streamed.
+    """
+    # Ground answers about objects in catalog data the user is cleared to see
+    personality = persona["personality"] + context_block(
+        catalog_retriever.retrieve(message, persona["clearance_level"])
+    )
+    
     fallback_reason = None
+    fallback_category = None
     
     try:
-        # Check if API key is available
-        if not EMERGENT_LLM_KEY:
-            logger.warning("EMERGENT_LLM_KEY not available - entering fallback mode")
-            using_fallback = True
+        # Check if the provider is configured
+        if not llm_provider.is_available():
+            logger.warning("LLM provider not available - entering fallback mode")
             fallback_reason = "No API key"
+            fallback_category = "no_api_key"
         else:
             # Try to use LLM API
             try:
-                # Initialize LLM chat
-                chat = LlmChat(
-                    api_key=EMERGENT_LLM_KEY,
-                    session_id=request.session_id,
-                    system_message=personality
-                ).with_model("openai", "gpt-4o-mini")
+                chunks = []
                 
-                # Send message
-                user_msg = UserMessage(text=request.message)
-                response = await chat.send_message(user_msg)
+                async def consume():
+                    async for chunk in llm_provider.stream(session_id, personality, message):
+                        chunks.append(chunk)
+                        if on_token:
+                            await on_token(chunk)
                 
-                # Detect emotion from response
-                emotion = detect_emotion_from_text(response)
-                
-                # Store assistant response
-                assistant_message_doc = {
-                    "id": str(datetime.now(timezone.utc).timestamp()),
-                    "session_id": request.session_id,
-                    "user_id": current_user["id"] if current_user else None,
-                    "role": "assistant",
-                    "content": response,
-                    "emotion": emotion,
-                    "timestamp": datetime.now(timezone.utc).isoformat(),
-                    "fallback_mode": False
-                }
-                await db.chat_messages.insert_one(assistant_message_doc)
-                
-                logger.info(f"Chat response generated successfully using API for session {request.session_id}")
-                return ChatResponse(response=response, emotion=emotion)
+                llm_start = time.perf_counter()
+                try:
+                    await asyncio.wait_for(consume(), timeout=LLM_TIMEOUT_SECONDS)
+                except Exception:
+                    LLM_REQUEST_SECONDS.observe(time.perf_counter() - llm_start, provider=llm_provider.name, model=llm_provider.model, outcome="error")
+                    raise
+                LLM_REQUEST_SECONDS.observe(time.perf_counter() - llm_start, provider=llm_provider.name, model=llm_provider.model, outcome="success")
                 
+                response = "".join(chunks)
+                chat_logger.info(f"Chat response generated successfully using API for session {session_id}")
+                CHAT_RESPONSES_TOTAL.inc(mode="llm", reason="")
+                # Detect emotion from response
+                return {"response": response, "emotion": detect_emotion_from_text(response), "fallback_mode": False}
+            
             except Exception as api_error:
                 # API call failed - enter fallback mode
-                error_str = str(api_error).lower()
                 logger.error(f"API error in chat: {str(api_error)}")
-                
-                # Determine if it's a rate limit/credit error
-                if any(keyword in error_str for keyword in ['rate limit', 'insufficient', 'quota', 'credit', '429', '402', 'billing']):
-                    fallback_reason = "API rate limit or insufficient credits"
-                    logger.warning(f"API credits exhausted or rate limited - entering fallback mode: {api_error}")
-                else:
-                    fallback_reason = f"API error: {str(api_error)[:100]}"
-                    logger.warning(f"API error - entering fallback mode: {api_error}")
-                
-                using_fallback = True
+                fallback_reason, fallback_category = classify_llm_error(api_error)
     
     except Exception as outer_error:
         # Unexpected error
         logger.error(f"Unexpected error in chat: {str(outer_error)}")
-        using_fallback = True
         fallback_reason = f"Unexpected error: {str(outer_error)[:100]}"
+        fallback_category = "unexpected"
     
     # FALLBACK MODE - Generate response using local logic
-    if using_fallback:
-        logger.info(f"Using fallback mode for session {request.session_id}. Reason: {fallback_reason}")
-        
-        # Get conversation length for context
-        conversation_length = len(history)
-        
-        # Generate fallback response
+    chat_logger.info(f"Using fallback mode for session {session_id}. Reason: {fallback_reason}")
+    
+    with FALLBACK_RESPONSE_SECONDS.time():
         fallback_response, emotion = get_fallback_response(
-            message=request.message,
-            user_name=user_name,
-            clearance_level=clearance_level,
-            is_admin=is_executioner,
+            message=message,
+            user_name=persona["user_name"],
+            clearance_level=persona["clearance_level"],
+            is_admin=persona["is_executioner"],
             conversation_length=conversation_length
         )
+    CHAT_RESPONSES_TOTAL.inc(mode="fallback", reason=fallback_category)
+    
+    # Add a subtle note about limited mode (only in console, not to user);
+    # kept for the debug buffer, written out only if an error follows
+    chat_logger.debug(f"Fallback response: {fallback_response[:100]}... | Emotion: {emotion}")
+    
+    return {
+        "response": fallback_response,
+        "emotion": emotion,
+        "fallback_mode": True,
+        "fallback_reason": fallback_reason
+    }
+
+async def store_reply(session_id: str, user_id: Optional[str], reply: dict) -> dict:
+    """Queue an assistant reply from generate_reply for persistence and return its document"""
+    fields = {"emotion": reply["emotion"], "fallback_mode": reply["fallback_mode"]}
+    if reply["fallback_mode"]:
+        fields["fallback_reason"] = reply["fallback_reason"]
+    message_doc = chat_message(session_id, user_id, "assistant", reply["response"], **fields)
+    # The user already has the reply; history reads flush it if it is still queued
+    unsaved_replies.setdefault(session_id, {})[message_doc["id"]] = message_doc
+    await job_runner.submit("chat", persist_reply, message_doc)
+    return message_doc
+
+async def run_chat_turn(
+    session_id: str,
+    user_id: Optional[str],
+    message: str,
+    persona: dict,
+    idempotency_key: Optional[str] = None,
+    conversation_length: Optional[int] = None,
+    on_token: Optional[Callable[[str], Awaitable[None]]] = None
+) -> dict:
+    """Store a user message and answer it in turn with the session's other messages.
+    
+    A retry with the same idempotency key returns the first attempt's reply
+    without storing the message or calling the LLM again.
+    """
+    async def answer(messages: List[str]) -> dict:
+        length = conversation_length
+        if length is None:
+            # Conversation history, including archived turns of a resumed session
+            await flush_replies(session_id)
+            length = len(await retention.recent_messages(db, session_id, CHAT_HISTORY_WINDOW))
+        reply = await generate_reply(session_id, "\n".join(messages), persona, length, on_token)
+        stored = await store_reply(session_id, user_id, reply)
+        return {**reply, "message_id": stored["id"]}
+    
+    async def turn() -> dict:
+        await store_chat_message(session_id, user_id, "user", message)
+        # Only the sender's own messages may share its persona and clearance
+        principal = (user_id, persona["user_name"], persona["clearance_level"])
+        return await chat_queue.submit(session_id, message, answer, principal)
+    
+    key = (session_id, user_id, idempotency_key) if idempotency_key else None
+    return await chat_queue.once(key, turn)
+
+@api_router.post("/chat", response_model=ChatResponse)
+async def chat_with_mal0(
+    request: ChatRequest,
+    http_request: Request,
+    idempotency_key: Optional[str] = Header(None, max_length=128),
+    current_user: Optional[dict] = Depends(get_current_user)
+):
+    """Chat with MAL0 assistant - Enhanced with personality and clearance awareness.
+    
+    Send an Idempotency-Key header to make retries of the same message safe.
+    """
+    principal = f"user:{current_user['id']}" if current_user else f"ip:{request_ip(http_request)}"
+    await enforce_rate_limits(
+        (chat_limiter, principal),
+        (chat_session_limiter, request.session_id)
+    )
+    
+    user_id = current_user["id"] if current_user else None
+    
+    # Get user info for personalization
+    persona = chat_persona(current_user)
+    
+    reply = await run_chat_turn(request.session_id, user_id, request.message, persona, idempotency_key)
+    
+    return ChatResponse(response=reply["response"], emotion=reply["emotion"])
+
+EMOTION_BOUNDARIES = (".", "!", "?", "…", "\n")
+
+@api_router.websocket("/chat/ws")
+async def chat_ws(websocket: WebSocket):
+    """Chat with MAL0 over one connection, streaming replies token by token.
+    
+    The principal, persona prompt and conversation window are set up once
+    and kept for the life of the connection. Clients send
+    {"type": "message", "message": ..., "idempotency_key": ...} (the key is
+    optional) or {"type": "ping"}; replies arrive
+    as start, token, emotion and done events. The done event carries the
+    final response, which replaces the streamed text after a fallback.
+    Messages sent during a reply are answered in order once it is done.
+    """
+    current_user = await get_websocket_user(websocket)
+    if not current_user:
+        await websocket.close(code=4401)
+        return
+    
+    await websocket.accept()
+    
+    user_id = current_user["id"]
+    session_id = websocket.query_params.get("session_id") or new_ulid()
+    persona = chat_persona(current_user)
+    conversation_length = len(await retention.recent_messages(db, session_id, CHAT_HISTORY_WINDOW))
+    
+    await websocket.send_json({
+        "type": "ready",
+        "session_id": session_id,
+        "user": persona["user_name"],
+        "clearance_level": persona["clearance_level"]
+    })
+    
+    async def refresh_principal() -> bool:
+        """Pick up clearance changes and deactivation from the principal cache"""
+        nonlocal current_user, persona
+        # A cached principal is as current as an HTTP request would see
+        user = await flights["principal"].cached(
+            principal_cache,
+            user_id,
+            lambda: db.users.find_one({"id": user_id}, {"_id": 0, "password_hash": 0})
+        )
+        if not user or not user.get("is_active", True):
+            return False
+        if user["clearance_level"] != current_user["clearance_level"] or user["username"] != current_user["username"]:
+            persona = chat_persona(user)
+        current_user = user
+        return True
+    
+    async def chat_turn(message: str, idempotency_key: Optional[str]):
+        nonlocal conversation_length
+        try:
+            await enforce_rate_limits(
+                (chat_limiter, f"user:{user_id}"),
+                (chat_session_limiter, session_id)
+            )
+        except HTTPException as e:
+            await websocket.send_json({
+                "type": "error",
+                "code": e.status_code,
+                "detail": e.detail,
+                "retry_after": int(e.headers["Retry-After"])
+            })
+            return
         
-        # Add a subtle note about limited mode (only in console, not to user)
-        logger.info(f"Fallback response: {fallback_response[:100]}... | Emotion: {emotion}")
+        conversation_length = min(conversation_length + 1, CHAT_HISTORY_WINDOW)
         
-        # Store assistant response with fallback flag
-        assistant_message_doc = {
-            "id": str(datetime.now(timezone.utc).timestamp()),
-            "session_id": request.session_id,
-            "user_id": current_user["id"] if current_user else None,
-            "role": "assistant",
-            "content": fallback_response,
-            "emotion": emotion,
-            "timestamp": datetime.now(timezone.utc).isoformat(),
-            "fallback_mode": True,
-            "fallback_reason": fallback_reason
-        }
-        await db.chat_messages.insert_one(assistant_message_doc)
+        await websocket.send_json({"type": "start"})
+        streamed = []
+        emotion = None
         
-        return ChatResponse(response=fallback_response, emotion=emotion)
+        async def send_token(chunk: str):
+            nonlocal emotion
+            streamed.append(chunk)
+            await websocket.send_json({"type": "token", "text": chunk})
+            # Re-read the mood once a sentence is complete
+            if chunk.rstrip(" ").endswith(EMOTION_BOUNDARIES):
+                detected = detect_emotion_from_text("".join(streamed))
+                if detected != emotion:
+                    emotion = detected
+                    await websocket.send_json({"type": "emotion", "emotion": emotion})
+        
+        reply = await run_chat_turn(session_id, user_id, message, persona, idempotency_key, conversation_length, send_token)
+        conversation_length = min(conversation_length + 1, CHAT_HISTORY_WINDOW)
+        
+        await websocket.send_json({
+            "type": "done",
+            "message_id": reply["message_id"],
+            "response": reply["response"],
+            "emotion": reply["emotion"],
+            "fallback_mode": reply["fallback_mode"]
+        })
+    
+    loop = asyncio.get_running_loop()
+    last_activity = loop.time()
+    receiver = asyncio.create_task(websocket.receive_text())
+    # Turns run beside the receive loop, so pings keep going during a long reply
+    turn: Optional[asyncio.Task] = None
+    queued = collections.deque()
+    try:
+        while True:
+            if turn is None and queued:
+                message, idempotency_key = queued.popleft()
+                if not await refresh_principal():
+                    await websocket.close(code=4401)
+                    break
+                turn = asyncio.create_task(chat_turn(message, idempotency_key))
+            
+            waiting = {receiver} if turn is None else {receiver, turn}
+            done, _ = await asyncio.wait(waiting, timeout=CHAT_WS_HEARTBEAT_S, return_when=asyncio.FIRST_COMPLETED)
+            if turn in done:
+                finished, turn = turn, None
+                last_activity = loop.time()
+                # Raises WebSocketDisconnect if the client left mid-reply
+                finished.result()
+            if receiver not in done:
+                if not done:
+                    if turn is None and loop.time() - last_activity >= CHAT_WS_IDLE_TIMEOUT_S:
+                        await websocket.close(code=4408)
+                        break
+                    await websocket.send_json({"type": "ping"})
+                continue
+            
+            raw = receiver.result()
+            receiver = asyncio.create_task(websocket.receive_text())
+            last_activity = loop.time()
+            try:
+                frame = json.loads(raw)
+            except ValueError:
+                frame = None
+            if not isinstance(frame, dict):
+                await websocket.send_json({"type": "error", "code": 400, "detail": "Invalid frame"})
+                continue
+            
+            if frame.get("type") == "ping":
+                await websocket.send_json({"type": "pong"})
+            elif frame.get("type") == "pong":
+                pass
+            elif frame.get("type") == "message":
+                message = frame.get("message")
+                if not isinstance(message, str) or not message.strip():
+                    await websocket.send_json({"type": "error", "code": 400, "detail": "Message is required"})
+                    continue
+                if len(queued) >= CHAT_WS_MAX_QUEUED:
+                    await websocket.send_json({"type": "error", "code": 429, "detail": "Too many messages waiting for a reply"})
+                    continue
+                idempotency_key = frame.get("idempotency_key")
+                queued.append((message, str(idempotency_key)[:128] if idempotency_key else None))
+            else:
+                await websocket.send_json({"type": "error", "code": 400, "detail": "Unknown frame type"})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        if turn is not None:
+            turn.cancel()
 
 @api_router.get("/chat/history/{session_id}")
-async def get_chat_history(session_id: str):
-    """Get chat history for a session"""
+async def get_chat_history(
+    session_id: str,
+    after: Optional[str] = None,
+    limit: int = Query(1000, ge=1, le=1000)
+):
+    """Get chat history for a session.
+    
+    Message ids double as cursors: pass the id of the last message seen as
+    `after` to receive only newer messages.
+    """
+    await flush_replies(session_id)
+    # Sessions idle long enough are compacted into a single archive document
+    archived = await retention.load_archived(db, session_id)
+    
+    query = {"session_id": session_id}
+    if after:
+        anchor = await db.chat_messages.find_one(
+            {"session_id": session_id, "id": after},
+            {"_id": 0, "timestamp": 1}
+        ) or next((message for message in archived if message["id"] == after), None)
+        if not anchor:
+            raise HTTPException(status_code=400, detail="Unknown cursor")
+        # Keyset on (timestamp, id); ids break ties within the same millisecond
+        query["$or"] = [
+            {"timestamp": {"$gt": anchor["timestamp"]}},
+            {"timestamp": anchor["timestamp"], "id": {"$gt": after}}
+        ]
+        archived = [
+            message for message in archived
+            if (message["timestamp"], message["id"]) > (anchor["timestamp"], after)
+        ]
+    
     history = await db.chat_messages.find(
-        {"session_id": session_id},
-        {"_id": 0}
-    ).sort("timestamp", 1).to_list(1000)
+        query,
+        {"_id": 0, "expire_at": 0}
+    ).sort([("timestamp", 1), ("id", 1)]).to_list(limit)
     
-    return history
+    return retention.merge_messages(archived, history)[:limit]
 
 # ============ ADMIN ROUTES ============
 
-@api_router.get("/admin/users", response_model=List[UserResponse])
-async def get_all_users(current_user: dict = Depends(require_clearance(5))):
-    """Get all users (Admin only)"""
-    users = await db.users.find({}, {"_id": 0, "password_hash": 0}).to_list(1000)
+# Shapes rows as UserResponse, so they are returned without being rebuilt as models
+USER_DIRECTORY_PROJECTION = {
+    "_id": 0, "id": 1, "username": 1, "clearance_level": 1, "created_at": 1, "is_active": 1
+}
+MAX_DIRECTORY_PAGE = 1000
+
+def encode_user_cursor(user: dict) -> str:
+    """Encode the (username_key, id) keyset position of a user as an opaque cursor"""
+    raw = f"{username_key(user['username'])}\x00{user['id']}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def decode_user_cursor(cursor: str) -> tuple:
+    """Decode a cursor produced by encode_user_cursor"""
+    try:
+        key, user_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("\x00", 1)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return key, user_id
+
+def build_user_conditions(
+    username_prefix: Optional[str] = None,
+    clearance_level: Optional[int] = None,
+    is_active: Optional[bool] = None
+) -> list:
+    """Build the query conditions shared by the user directory and bulk operations"""
+    conditions = []
+    if username_prefix:
+        # Anchored prefix on the case-folded key, so it stays an index range scan
+        conditions.append({"username_key": {"$regex": "^" + re.escape(username_key(username_prefix))}})
+    if clearance_level is not None:
+        conditions.append({"clearance_level": clearance_level})
+    if is_active is not None:
+        conditions.append({"is_active": is_active})
+    return conditions
+
+async def find_directory_page(
+    q: Optional[str],
+    clearance_level: Optional[int],
+    is_active: Optional[bool],
+    cursor: Optional[str],
+    limit: int
+) -> tuple:
+    """(users in directory order after cursor, cursor of the next page or None)"""
+    conditions = build_user_conditions(q, clearance_level, is_active)
+    if cursor:
+        last_key, last_id = decode_user_cursor(cursor)
+        conditions.append({"$or": [
+            {"username_key": {"$gt": last_key}},
+            {"username_key": last_key, "id": {"$gt": last_id}}
+        ]})
+    
+    query = {"$and": conditions} if conditions else {}
+    users = await db.users.find(query, USER_DIRECTORY_PROJECTION).sort(
+        [("username_key", 1), ("id", 1)]
+    ).limit(limit + 1).to_list(limit + 1)
+    
+    if len(users) > limit:
+        users = users[:limit]
+        return users, encode_user_cursor(users[-1])
+    return users, None
+
+@api_router.get("/admin/users", response_model=None, responses={200: {"model": List[UserResponse]}})
+async def get_all_users(
+    response: Response,
+    q: Optional[str] = None,
+    clearance_level: Optional[int] = None,
+    is_active: Optional[bool] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(MAX_DIRECTORY_PAGE, ge=1, le=MAX_DIRECTORY_PAGE),
+    current_user: dict = Depends(require_clearance(5))
+):
+    """Get users ordered by username, with prefix search (Admin only).
+    
+    At most `limit` users are returned; when more match, the X-Next-Cursor
+    header holds the cursor to pass back for the rest.
+    """
+    users, next_cursor = await find_directory_page(q, clearance_level, is_active, cursor, limit)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return users
+
+@api_router.get("/admin/users/page", response_model=None, responses={200: {"model": UserPage}})
+async def get_users_page(
+    q: Optional[str] = None,
+    clearance_level: Optional[int] = None,
+    is_active: Optional[bool] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    current_user: dict = Depends(require_clearance(5))
+):
+    """Get a page of users ordered by username, with prefix search (Admin only)"""
+    users, next_cursor = await find_directory_page(q, clearance_level, is_active, cursor, limit)
+    return {"users": users, "next_cursor": next_cursor}
+
+MAX_BULK_USERS = 10000
+
+async def apply_bulk_user_update(
+    user_ids: Optional[List[str]],
+    user_filter: Optional[BulkUserFilter],
+    field: str,
+    value
+) -> dict:
+    """Set one field on many users with a single bulk_write and report per-id results"""
+    if user_ids is not None:
+        ids = list(dict.fromkeys(user_ids))
+        query = {"id": {"$in": ids}}
+    elif user_filter is not None:
+        conditions = build_user_conditions(**user_filter.model_dump())
+        if not conditions:
+            raise HTTPException(status_code=400, detail="Filter must contain at least one condition")
+        ids = None
+        query = {"$and": conditions}
+    else:
+        raise HTTPException(status_code=400, detail="Either user_ids or filter is required")
     
-    result = []
-    for user in users:
-        created_at = user["created_at"]
-        if isinstance(created_at, str):
-            created_at = datetime.fromisoformat(created_at)
-        
-        result.append(UserResponse(
-            id=user["id"],
-            username=user["username"],
-            clearance_level=user["clearance_level"],
-            created_at=created_at,
-            is_active=user["is_active"]
-        ))
+    if ids is not None and len(ids) > MAX_BULK_USERS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_USERS} users per request")
+    
+    current = await db.users.find(query, {"_id": 0, "id": 1, field: 1}).to_list(MAX_BULK_USERS + 1)
+    if len(current) > MAX_BULK_USERS:
+        raise HTTPException(status_code=400, detail=f"Filter matches more than {MAX_BULK_USERS} users")
     
+    current_values = {user["id"]: user.get(field) for user in current}
+    if ids is None:
+        ids = sorted(current_values)
+    
+    to_update = [user_id for user_id in ids if user_id in current_values and current_values[user_id] != value]
+    if to_update:
+        await db.users.bulk_write(
+            [UpdateOne({"id": user_id}, {"$set": {field: value}}) for user_id in to_update],
+            ordered=False
+        )
+        await invalidation_bus.invalidate("principal", to_update)
+    
+    updated = set(to_update)
+    results = []
+    for user_id in ids:
+        if user_id not in current_values:
+            status = "not_found"
+        elif user_id in updated:
+            status = "updated"
+        else:
+            status = "unchanged"
+        results.append({"id": user_id, "status": status})
+    
+    return {
+        "matched": len(current_values),
+        "updated": len(updated),
+        "results": results
+    }
+
+@api_router.put("/admin/users/bulk/clearance")
+async def bulk_update_user_clearance(
+    request: BulkClearanceUpdate,
+    current_user: dict = Depends(require_clearance(5))
+):
+    """Update clearance level for many users at once (Admin only)"""
+    if request.clearance_level < 1 or request.clearance_level > 5:
+        raise HTTPException(status_code=400, detail="Clearance level must be between 1 and 5")
+    
+    result = await apply_bulk_user_update(request.user_ids, request.filter, "clearance_level", request.clearance_level)
+    logger.info(f"Bulk clearance update by admin {current_user['username']}: {result['updated']} of {result['matched']} users")
+    return result
+
+@api_router.put("/admin/users/bulk/status")
+async def bulk_update_user_status(
+    request: BulkStatusUpdate,
+    current_user: dict = Depends(require_clearance(5))
+):
+    """Activate/deactivate many users at once (Admin only)"""
+    result = await apply_bulk_user_update(request.user_ids, request.filter, "is_active", request.is_active)
+    logger.info(f"Bulk status update by admin {current_user['username']}: {result['updated']} of {result['matched']} users")
     return result
 
 @api_router.put("/admin/users/{user_id}/clearance")
@@ -801,6 +1720,8 @@ async def update_user_clearance(
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
     
+    await invalidation_bus.invalidate("principal", [user_id])
+    
     return {"message": "Clearance level updated successfully"}
 
 @api_router.put("/admin/users/{user_id}/status")
@@ -818,8 +1739,127 @@ async def update_user_status(
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
     
+    await invalidation_bus.invalidate("principal", [user_id])
+    
     return {"message": "User status updated successfully"}
 
+# ============ BULK EXPORT / IMPORT ROUTES ============
+
+# Collection -> (projection, sort); sorts follow existing indexes
+EXPORTS = {
+    "scp_objects": ({"_id": 0}, [("number", 1)]),
+    "users": ({"_id": 0, "password_hash": 0}, [("id", 1)]),
+    "chat_messages": ({"_id": 0}, [("session_id", 1), ("timestamp", 1), ("id", 1)]),
+}
+
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', '500'))
+
+@api_router.get("/admin/export/{collection}")
+async def export_collection(
+    collection: str,
+    session_id: Optional[str] = None,
+    current_user: dict = Depends(require_clearance(5))
+):
+    """Stream a collection as NDJSON (Admin only)"""
+    if collection not in EXPORTS:
+        raise HTTPException(status_code=404, detail="Unknown collection")
+    
+    projection, sort = EXPORTS[collection]
+    query = {"session_id": session_id} if collection == "chat_messages" and session_id else {}
+    cursor = read_db[collection].find(query, projection).sort(sort)
+    
+    logger.info(f"Export of {collection} started by admin {current_user['username']}")
+    
+    return StreamingResponse(
+        bulk_io.export_lines(cursor),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{collection}.ndjson"'}
+    )
+
+@api_router.post("/admin/import/scp_objects")
+async def import_scp_objects(
+    request: Request,
+    ordered: bool = False,
+    upsert: bool = False,
+    current_user: dict = Depends(require_clearance(5))
+):
+    """Bulk-create SCP objects from an NDJSON body of SCPObjectCreate lines (Admin only).
+    
+    With upsert=true existing numbers are overwritten instead of reported as
+    duplicates. With ordered=true the import stops at the first bad line.
+    """
+    async def write_batch(batch):
+        async with catalog_versions.reserve(db, len(batch)) as first_version:
+            now = datetime.now(timezone.utc)
+            existing_levels = {}
+            if upsert:
+                existing_levels = {
+                    obj["number"]: get_required_clearance(obj["threat_class"])
+                    for obj in await db.scp_objects.find(
+                        {"number": {"$in": [obj_data.number for _, obj_data in batch]}},
+                        {"_id": 0, "number": 1, "threat_class": 1}
+                    ).to_list(None)
+                }
+            operations = []
+            for offset, (_, obj_data) in enumerate(batch):
+                doc = SCPObject(**obj_data.model_dump(), version=first_version + offset, updated_at=now).model_dump()
+                entry = catalog_versions.clearance_entry(doc["version"], doc["threat_class"])
+                if upsert:
+                    # Existing objects keep their id and creation time
+                    insert_only = {"id": doc.pop("id"), "created_at": doc.pop("created_at")}
+                    update = {"$set": doc, "$setOnInsert": insert_only}
+                    if doc["number"] not in existing_levels:
+                        insert_only["clearance_history"] = [entry]
+                    elif existing_levels[doc["number"]] != entry["level"]:
+                        update["$push"] = {"clearance_history": entry}
+                    operations.append(UpdateOne({"number": doc["number"]}, update, upsert=True))
+                else:
+                    doc["clearance_history"] = [entry]
+                    operations.append(InsertOne(doc))
+            
+            try:
+                result = await db.scp_objects.bulk_write(operations, ordered=ordered)
+                written = result.inserted_count + result.upserted_count + result.matched_count
+                failures = []
+            except BulkWriteError as e:
+                details = e.details
+                written = details["nInserted"] + details["nUpserted"] + details["nMatched"]
+                failures = [(batch[error["index"]][0], error["errmsg"]) for error in details["writeErrors"]]
+        
+        failed_lines = {line for line, _ in failures}
+        attempted = batch
+        if failures and ordered:
+            # An ordered write stops at its first failure; later lines never ran
+            attempted = [item for item in batch if item[0] < failures[0][0]]
+        await catalog_versions.clear_tombstones(db, [obj.number for line, obj in attempted if line not in failed_lines])
+        return written, failures
+    
+    report = await bulk_io.import_lines(request.stream(), SCPObjectCreate, write_batch, ordered, IMPORT_BATCH_SIZE)
+    
+    if report.written:
+        # Search index, retrieval passages and object caches reload in every worker
+        await invalidation_bus.invalidate("catalog")
+        await invalidation_bus.invalidate("scp_object")
+    
+    logger.info(f"Import of {report.written} SCP objects by admin {current_user['username']}, {report.error_count} errors")
+    
+    return report.as_dict()
+
+# ============ PROFILING ROUTES ============
+
+@api_router.get("/admin/profiles")
+async def list_profiles(current_user: dict = Depends(require_clearance(5))):
+    """List captured request profiles, newest first (Admin only)"""
+    return await asyncio.to_thread(profile_store.list)
+
+@api_router.get("/admin/profiles/{name}")
+async def get_profile(name: str, current_user: dict = Depends(require_clearance(5))):
+    """Get one captured request profile (Admin only)"""
+    capture = await asyncio.to_thread(profile_store.read, name)
+    if capture is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return capture
+
 # ============ ROOT ROUTE ============
 
 @api_router.get("/")
@@ -835,14 +1875,69 @@ async def root():
         ]
     }
 
-# Include the router in the main app
-app.include_router(api_router)
+async def authorize_metrics(authorization: str) -> bool:
+    """Allow the configured scrape token or a clearance level 5 user"""
+    if METRICS_TOKEN and authorization.lower().startswith("bearer "):
+        if hmac.compare_digest(authorization[7:].encode(), METRICS_TOKEN.encode()):
+            return True
+    return await authorize_profiling(authorization)
 
-# CORS Middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+async def get_metrics(authorization: str = Header("")):
+    """Expose metrics in Prometheus text exposition format (scrape token or admin only)"""
+    if not await authorize_metrics(authorization):
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+    return Response(content=metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+def create_app() -> FastAPI:
+    """Build the application; the database connects when the app starts serving"""
+    app = FastAPI(lifespan=lifespan, default_response_class=DefaultJSONResponse)
+    
+    app.add_api_route("/metrics", get_metrics, methods=["GET"], include_in_schema=False)
+    
+    # Include the router in the main app
+    app.include_router(api_router)
+    
+    # Negotiated gzip/brotli for large bodies
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=int(os.environ.get('COMPRESSION_MIN_BYTES', '1024')),
+        gzip_level=int(os.environ.get('COMPRESSION_GZIP_LEVEL', '6')),
+        brotli_quality=int(os.environ.get('COMPRESSION_BROTLI_QUALITY', '5'))
+    )
+    
+    # Per-route latency histograms
+    app.add_middleware(metrics.MetricsMiddleware)
+    
+    # Slow-request capture and admin-requested profiling
+    app.add_middleware(
+        ProfilingMiddleware,
+        store=profile_store,
+        sampler=stack_sampler,
+        slow_threshold_seconds=PROFILE_SLOW_MS / 1000,
+        authorize=authorize_profiling
+    )
+    
+    # Load shedding sits inside CORS so browsers can read the 503
+    app.add_middleware(
+        AdmissionMiddleware,
+        monitor=loop_monitor,
+        classify=request_priority,
+        lag_threshold_seconds=ADMISSION_LAG_MS / 1000,
+        severe_lag_seconds=ADMISSION_SEVERE_LAG_MS / 1000,
+        max_in_flight=ADMISSION_MAX_IN_FLIGHT,
+        retry_after_seconds=ADMISSION_RETRY_AFTER_S
+    )
+    
+    # CORS Middleware
+    app.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["X-Next-Cursor"],
+    )
+    
+    return app
+
+app = create_app()
@@ -0,0 +1,112 @@
+"""
+Per-session ordering of chat turns.
+
+Turns for one session run one at a time, in arrival order, on a worker task
+that exists only while the session has work queued; other sessions are not
+held up. With a coalescing window, messages from the same principal that
+arrive while a session is busy or within the window are answered by a
+single LLM call; a batch never mixes principals, since each turn is
+answered with its sender's persona and clearance. Retries that
+carry the same idempotency key share the first attempt's result instead of
+paying for another completion.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+import metrics
+from cache import TTLCache
+from singleflight import SingleFlight
+
+TURNS_TOTAL = metrics.counter(
+    "chat_turns_total", "Chat turns run by the per-session queue"
+)
+COALESCED_TOTAL = metrics.counter(
+    "chat_coalesced_messages_total", "Chat messages answered together with an earlier message"
+)
+ACTIVE_SESSIONS = metrics.gauge(
+    "chat_sessions_busy", "Chat sessions with a turn running or queued"
+)
+
+Run = Callable[[List[str]], Awaitable[Any]]
+
+
+def _retrieve(future: asyncio.Future):
+    # A caller that went away leaves its result behind; do not log it as lost
+    if not future.cancelled():
+        future.exception()
+
+
+class SessionQueue:
+    """Serialize turns per session, optionally coalescing and deduplicating them"""
+
+    def __init__(self, coalesce_window: float = 0.0, max_batch: int = 5, idempotency_ttl: float = 600.0):
+        self.coalesce_window = coalesce_window
+        self.max_batch = max_batch
+        self.results = TTLCache("chat_idempotency", idempotency_ttl)
+        self.flight = SingleFlight("chat_idempotency")
+        self._pending: Dict[str, List[Tuple[str, Run, asyncio.Future, Hashable]]] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+
+    async def submit(self, session_id: str, message: str, run: Run, principal: Hashable = None) -> Any:
+        """Queue a message and return the result of the turn that answered it.
+
+        run(messages) is called with the message alone, or when coalescing
+        with it and the neighbouring messages of the same principal; the
+        first message's run answers the batch.
+        """
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_retrieve)
+        self._pending.setdefault(session_id, []).append((message, run, future, principal))
+        if session_id not in self._workers:
+            self._workers[session_id] = asyncio.create_task(self._drain(session_id))
+        # A caller that disconnects must not abort a turn others may share
+        return await asyncio.shield(future)
+
+    async def once(self, key: Optional[Hashable], turn: Callable[[], Awaitable[Any]]) -> Any:
+        """Run turn() once per idempotency key; repeats get the first result"""
+        if key is None:
+            return await turn()
+        return await self.flight.cached(self.results, key, turn)
+
+    async def _drain(self, session_id: str):
+        pending = self._pending[session_id]
+        batch: List[Tuple[str, Run, asyncio.Future, Hashable]] = []
+        ACTIVE_SESSIONS.inc()
+        try:
+            while pending:
+                if self.coalesce_window > 0:
+                    await asyncio.sleep(self.coalesce_window)
+                    # Consecutive messages only, so turns stay in arrival order
+                    principal = pending[0][3]
+                    batch = []
+                    for entry in pending[:self.max_batch]:
+                        if entry[3] != principal:
+                            break
+                        batch.append(entry)
+                else:
+                    batch = pending[:1]
+                del pending[:len(batch)]
+
+                TURNS_TOTAL.inc()
+                if len(batch) > 1:
+                    COALESCED_TOTAL.inc(len(batch) - 1)
+                try:
+                    result = await batch[0][1]([entry[0] for entry in batch])
+                except Exception as e:
+                    for entry in batch:
+                        entry[2].set_exception(e)
+                else:
+                    for entry in batch:
+                        entry[2].set_result(result)
+                batch = []
+        finally:
+            # Only reached early on shutdown; nobody is left to run these
+            for entry in batch + pending:
+                if not entry[2].done():
+                    entry[2].cancel()
+            del self._pending[session_id]
+            del self._workers[session_id]
+            ACTIVE_SESSIONS.dec()
+
+    def __len__(self) -> int:
+        return len(self._workers)
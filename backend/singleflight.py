@@ -0,0 +1,70 @@
+"""
+Coalescing of concurrent loads for the same key.
+
+When a cached value is missing, the first caller starts the load and every
+concurrent caller for that key awaits the same result, so a cold start or an
+invalidation costs one database query instead of one per request.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Optional
+
+from cache import MISSING
+
+
+class SingleFlight:
+    """Run at most one load per key at a time and share its result"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.loads = 0
+        self.coalesced = 0
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self._epoch = 0
+
+    async def do(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """Return loader()'s result, joining a load already in flight for key"""
+        task = self._calls.get(key)
+        if task is None:
+            self.loads += 1
+            task = asyncio.ensure_future(loader())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        else:
+            self.coalesced += 1
+        # A caller that goes away must not cancel the load for everybody else
+        return await asyncio.shield(task)
+
+    async def cached(self, cache, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """Read key through a cache.TTLCache, loading misses once for all concurrent callers"""
+        value = cache.get(key)
+        if value is not MISSING:
+            return value
+
+        async def load_and_store():
+            epoch = self._epoch
+            value = await loader()
+            # Skip the store if the key was invalidated while the load ran
+            if epoch == self._epoch:
+                cache.set(key, value)
+            return value
+
+        return await self.do(key, load_and_store)
+
+    def forget(self, keys: Optional[Iterable[Hashable]] = None):
+        """Detach in-flight loads so later callers start fresh; keys=None detaches all"""
+        self._epoch += 1
+        if keys is None:
+            self._calls.clear()
+        else:
+            for key in keys:
+                self._calls.pop(key, None)
+
+    def _finished(self, key: Hashable, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # Mark the exception retrieved; every waiter has already seen it
+            task.exception()
+
+    def __len__(self) -> int:
+        return len(self._calls)
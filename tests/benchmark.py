@@ -0,0 +1,295 @@
+"""
+In-process load test for the backend API.
+
+Runs the FastAPI app in this process against an in-memory Mongo stand-in
+(mongomock-motor) and the stub LLM provider with configurable latency and
+error injection, drives a weighted
+mix of operations at fixed concurrency and prints a JSON report with
+throughput and latency percentiles. Reports use stable key order so two runs
+can be diffed directly.
+
+Usage (from the repository root):
+    python -m tests.benchmark --requests 2000 --concurrency 16
+    python -m tests.benchmark --mix chat=60,catalog=40 --llm-latency 0.3 --output bench.json
+"""
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+
+DEFAULT_MIX = {
+    "login": 5,
+    "catalog": 30,
+    "object": 20,
+    "chat": 30,
+    "history": 10,
+    "dossier": 5,
+}
+
+# Statuses that count as success besides 2xx: clearance denials and
+# "already pending" dossier rejections are part of a realistic mix
+EXPECTED_STATUSES = {
+    "object": {403},
+    "dossier": {400},
+}
+
+def load_app(args):
+    """Import the server wired to the in-memory database and the stub LLM provider"""
+    import mongomock_motor
+    import motor.motor_asyncio
+
+    os.environ.setdefault("MONGO_URL", "mongodb://benchmark")
+    os.environ.setdefault("DB_NAME", "benchmark")
+    # All simulated users share one client address; measure the API, not the limiter
+    for limiter in ("CHAT", "CHAT_SESSION", "LOGIN", "LOGIN_ACCOUNT"):
+        os.environ.setdefault(f"{limiter}_RATE_LIMIT_PER_MIN", "0")
+    # Report how slow overload gets rather than how much of it is shed
+    os.environ.setdefault("ADMISSION_LAG_MS", "0")
+    os.environ["LLM_PROVIDER"] = "replay" if args.llm_recordings else "stub"
+    os.environ["LLM_STUB_FIRST_TOKEN_MS"] = str(args.llm_latency * 1000)
+    os.environ["LLM_STUB_TOKEN_MS"] = str(args.llm_token_latency * 1000)
+    os.environ["LLM_STUB_TIMEOUT_S"] = str(args.llm_timeout)
+    os.environ["LLM_STUB_SEED"] = str(args.seed)
+    for kind, rate in args.llm_errors.items():
+        os.environ[f"LLM_STUB_ERROR_{kind.upper()}"] = str(rate)
+    if args.llm_recordings:
+        os.environ["LLM_RECORDINGS_PATH"] = args.llm_recordings
+
+    motor.motor_asyncio.AsyncIOMotorClient = mongomock_motor.AsyncMongoMockClient
+    sys.path.insert(0, str(BACKEND_DIR))
+
+    import server
+    # The server keeps its shipped logging setup; only the load generator's own client is quiet
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    return server
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(fraction * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(samples: list, errors: int, elapsed: float) -> dict:
+    latencies = sorted(samples)
+    count = len(latencies)
+    return {
+        "count": count,
+        "errors": errors,
+        "throughput_rps": round(count / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(sum(latencies) / count * 1000, 3) if count else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p90_ms": round(percentile(latencies, 0.90) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3) if count else 0.0,
+    }
+
+
+class Benchmark:
+    """Drive a weighted operation mix against the app through an ASGI transport"""
+
+    def __init__(self, server, args):
+        import httpx
+
+        self.server = server
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=server.app), base_url="http://benchmark"
+        )
+        self.users = []
+        self.admin_headers = {}
+        self.object_numbers = []
+        self.dossier_payload = base64.b64encode(os.urandom(args.dossier_kb * 1024)).decode("ascii")
+        self.samples = {}
+        self.errors = {}
+        self.lifespan = None
+
+    async def setup(self):
+        self.lifespan = self.server.app.router.lifespan_context(self.server.app)
+        await self.lifespan.__aenter__()
+
+        response = await self.client.post("/api/auth/login", json={"username": "admin", "password": "admin123"})
+        response.raise_for_status()
+        self.admin_headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        for i in range(self.args.users):
+            username = f"bench-user-{i}"
+            response = await self.client.post("/api/auth/register", json={
+                "username": username, "password": "bench-password", "clearance_level": 1 + i % 4
+            })
+            response.raise_for_status()
+            body = response.json()
+            self.users.append({
+                "username": username,
+                "id": body["user"]["id"],
+                "headers": {"Authorization": f"Bearer {body['access_token']}"},
+                "session_id": f"bench-session-{i}",
+            })
+
+        response = await self.client.get("/api/scp", headers=self.admin_headers)
+        self.object_numbers = [obj["number"] for obj in response.json()]
+
+    async def teardown(self):
+        await self.client.aclose()
+        await self.lifespan.__aexit__(None, None, None)
+
+    async def op_login(self, user):
+        return await self.client.post("/api/auth/login", json={"username": user["username"], "password": "bench-password"})
+
+    async def op_catalog(self, user):
+        return await self.client.get("/api/scp", headers=user["headers"])
+
+    async def op_object(self, user):
+        number = self.rng.choice(self.object_numbers)
+        return await self.client.get(f"/api/scp/{number}", headers=user["headers"])
+
+    async def op_chat(self, user):
+        message = self.rng.choice(["Привет", "Расскажи об объекте 0051", "Что такое класс угрозы Apex?", "Спасибо!"])
+        return await self.client.post("/api/chat", headers=user["headers"], json={
+            "message": message, "session_id": user["session_id"]
+        })
+
+    async def op_history(self, user):
+        return await self.client.get(f"/api/chat/history/{user['session_id']}")
+
+    async def op_dossier(self, user):
+        return await self.client.post("/api/dossier/submit", headers=user["headers"], json={
+            "file_name": "dossier.pdf",
+            "file_data": self.dossier_payload,
+            "file_type": "application/pdf",
+            "file_size": self.args.dossier_kb * 1024,
+        })
+
+    async def after_dossier(self, user, response):
+        """Clear the pending submission so the user can upload again"""
+        if response.status_code == 200:
+            await self.client.put(
+                f"/api/admin/dossiers/{response.json()['dossier_id']}/moderate",
+                headers=self.admin_headers, json={"status": "approved"}
+            )
+
+    async def worker(self, plan: asyncio.Queue):
+        while True:
+            try:
+                operation, user = plan.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            handler = getattr(self, f"op_{operation}")
+            response = None
+            start = time.perf_counter()
+            try:
+                response = await handler(user)
+                ok = response.status_code < 400 or response.status_code in EXPECTED_STATUSES.get(operation, ())
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - start
+            self.samples.setdefault(operation, []).append(elapsed)
+            if not ok:
+                self.errors[operation] = self.errors.get(operation, 0) + 1
+
+            # Housekeeping calls are not part of the measurement
+            after = getattr(self, f"after_{operation}", None)
+            if after and response is not None:
+                await after(user, response)
+
+    async def run(self) -> dict:
+        mix = self.args.mix
+        operations = sorted(mix)
+        weights = [mix[name] for name in operations]
+
+        plan = asyncio.Queue()
+        for _ in range(self.args.requests):
+            plan.put_nowait((self.rng.choices(operations, weights)[0], self.rng.choice(self.users)))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(self.worker(plan) for _ in range(self.args.concurrency)))
+        elapsed = time.perf_counter() - start
+
+        all_samples = [sample for samples in self.samples.values() for sample in samples]
+        return {
+            "config": {
+                "requests": self.args.requests,
+                "concurrency": self.args.concurrency,
+                "users": self.args.users,
+                "llm_latency_s": self.args.llm_latency,
+                "llm_token_latency_s": self.args.llm_token_latency,
+                "llm_errors": self.args.llm_errors,
+                "dossier_kb": self.args.dossier_kb,
+                "mix": mix,
+                "seed": self.args.seed,
+            },
+            "elapsed_s": round(elapsed, 3),
+            "total": summarize(all_samples, sum(self.errors.values()), elapsed),
+            "operations": {
+                name: summarize(self.samples.get(name, []), self.errors.get(name, 0), elapsed)
+                for name in operations
+            },
+        }
+
+
+def parse_mix(value: str) -> dict:
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"Unknown operation '{name}', expected one of {sorted(DEFAULT_MIX)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def parse_llm_errors(value: str) -> dict:
+    errors = {}
+    for part in value.split(","):
+        kind, _, rate = part.partition("=")
+        if kind not in ("429", "402", "timeout"):
+            raise argparse.ArgumentTypeError(f"Unknown error kind '{kind}', expected 429, 402 or timeout")
+        errors[kind] = float(rate)
+    return errors
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000, help="Total operations to run")
+    parser.add_argument("--concurrency", type=int, default=16, help="Operations in flight at once")
+    parser.add_argument("--users", type=int, default=10, help="Registered users to spread load over")
+    parser.add_argument("--mix", type=parse_mix, default=dict(DEFAULT_MIX), help="Weights, e.g. chat=60,catalog=40")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Stub LLM time to first token in seconds")
+    parser.add_argument("--llm-token-latency", type=float, default=0.0, help="Stub LLM delay between tokens in seconds")
+    parser.add_argument("--llm-errors", type=parse_llm_errors, default={}, help="Injected error rates, e.g. 429=0.05,timeout=0.01")
+    parser.add_argument("--llm-timeout", type=float, default=5.0, help="How long injected timeouts hang before failing")
+    parser.add_argument("--llm-recordings", help="Replay LLM responses from this recordings file")
+    parser.add_argument("--dossier-kb", type=int, default=256, help="Size of uploaded dossier files")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for the operation plan")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    server = load_app(args)
+    benchmark = Benchmark(server, args)
+    await benchmark.setup()
+    try:
+        report = await benchmark.run()
+    finally:
+        await benchmark.teardown()
+
+    output = json.dumps(report, indent=2, sort_keys=True, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(output + "\n", encoding="utf-8")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,45 @@
+"""
+Cold-start budget: importing the app must not connect to Mongo or load the
+LLM, Motor or seed-data modules. pymongo itself is cheap and needed for
+bulk operations, so the server imports it up front.
+"""
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+IMPORT_BUDGET_S = float(os.environ.get('IMPORT_BUDGET_S', '1.5'))
+DEFERRED_MODULES = ("motor", "emergentintegrations", "litellm", "scp_data", "passlib")
+
+PROBE = f"""
+import json, sys, time
+start = time.perf_counter()
+import server
+elapsed = time.perf_counter() - start
+app = server.app
+print(json.dumps({{
+    "elapsed": elapsed,
+    "loaded": [name for name in {DEFERRED_MODULES!r} if name in sys.modules],
+    "routes": len(app.routes),
+}}))
+"""
+
+
+def test_server_import_is_cheap():
+    env = dict(os.environ, MONGO_URL="mongodb://127.0.0.1:1", DB_NAME="import_time_test")
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE], cwd=BACKEND_DIR, env=env,
+        capture_output=True, text=True, timeout=60,
+    )
+    assert result.returncode == 0, result.stderr
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+
+    assert report["loaded"] == []
+    assert report["routes"] > 0
+    assert report["elapsed"] < IMPORT_BUDGET_S, report
@@ -0,0 +1,129 @@
+"""
+Cache coherence across worker processes sharing the pub/sub socket hub.
+"""
+import asyncio
+import multiprocessing
+import sys
+from pathlib import Path
+
+BACKEND_DIR = str(Path(__file__).resolve().parent.parent / "backend")
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from cache import TTLCache  # noqa: E402
+from invalidation import InvalidationBus  # noqa: E402
+from pubsub import LocalBackend, PubSub, SocketBackend, SocketHub  # noqa: E402
+
+USER_IDS = ("u1", "u2", "u3")
+
+
+def _make_caches(bus: InvalidationBus):
+    principals = bus.register(TTLCache("principal", 60))
+    catalog = bus.register(TTLCache("catalog", 60))
+    for user_id in USER_IDS:
+        principals.set(user_id, {"id": user_id, "clearance_level": 1})
+    catalog.set("all", [{"number": "0051"}])
+    return principals, catalog
+
+
+def _worker(socket_path: str, index: int, expected_messages: int, ready, results):
+    """Simulate one uvicorn worker holding warm caches"""
+    sys.path.insert(0, BACKEND_DIR)
+
+    async def run():
+        pubsub = PubSub(SocketBackend(socket_path))
+        await pubsub.start()
+        bus = InvalidationBus(pubsub)
+        principals, catalog = _make_caches(bus)
+        bus.start()
+        ready.put(index)
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + 10
+        while bus.received < expected_messages and loop.time() < deadline:
+            await asyncio.sleep(0.01)
+
+        results.put({
+            "index": index,
+            "principals": [user_id for user_id in USER_IDS if principals.get(user_id, None) is not None],
+            "catalog_entries": len(catalog),
+        })
+        await bus.stop()
+        await pubsub.stop()
+
+    asyncio.run(run())
+
+
+def test_invalidations_reach_every_worker(tmp_path):
+    workers = 4
+    socket_path = str(tmp_path / "hub.sock")
+    context = multiprocessing.get_context("spawn")
+    ready = context.Queue()
+    results = context.Queue()
+
+    async def run():
+        hub = SocketHub(socket_path)
+        await hub.start()
+        processes = [
+            context.Process(target=_worker, args=(socket_path, i, 2, ready, results))
+            for i in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        try:
+            for _ in range(workers):
+                await asyncio.to_thread(ready.get, True, 30)
+
+            # This process plays the worker that handled the admin edit
+            pubsub = PubSub(SocketBackend(socket_path))
+            await pubsub.start()
+            bus = InvalidationBus(pubsub)
+            principals, catalog = _make_caches(bus)
+            await bus.invalidate("principal", ["u1", "u2"])
+            await bus.invalidate("catalog")
+
+            assert [user_id for user_id in USER_IDS if principals.get(user_id, None)] == ["u3"]
+            assert len(catalog) == 0
+
+            reports = [await asyncio.to_thread(results.get, True, 30) for _ in range(workers)]
+            await pubsub.stop()
+        finally:
+            for process in processes:
+                process.join(timeout=10)
+                if process.is_alive():
+                    process.terminate()
+            await hub.stop()
+        return reports
+
+    reports = asyncio.run(run())
+
+    assert sorted(report["index"] for report in reports) == list(range(workers))
+    for report in reports:
+        assert report["principals"] == ["u3"], report
+        assert report["catalog_entries"] == 0, report
+
+
+def test_local_invalidation_is_applied_once():
+    async def run():
+        pubsub = PubSub(LocalBackend())
+        await pubsub.start()
+        bus = InvalidationBus(pubsub)
+        principals, _ = _make_caches(bus)
+        seen = []
+        bus.on_invalidate(lambda cache_name, keys: seen.append((cache_name, keys)))
+        bus.start()
+
+        await bus.invalidate("principal", ["u1"])
+        await asyncio.sleep(0.05)
+
+        await bus.stop()
+        await pubsub.stop()
+        return principals, seen, bus.received
+
+    principals, seen, received = asyncio.run(run())
+
+    assert principals.get("u1", None) is None
+    assert principals.get("u2", None) is not None
+    # Our own broadcast is ignored by our listener
+    assert seen == [("principal", ["u1"])]
+    assert received == 0
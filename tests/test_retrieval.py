@@ -0,0 +1,111 @@
+"""
+Catalog search index and clearance-partitioned retrieval.
+"""
+import sys
+from pathlib import Path
+
+BACKEND_DIR = str(Path(__file__).resolve().parent.parent / "backend")
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from retrieval import CatalogRetriever, context_block, estimate_tokens  # noqa: E402
+from search_index import SearchIndex  # noqa: E402
+
+SECRET = "координаты тайника омега"
+
+
+def _object(number, name, threat_class="Threat", description="", secret_data=SECRET):
+    return {
+        "number": number,
+        "name": name,
+        "codename": f"Код-{number}",
+        "threat_class": threat_class,
+        "description": description,
+        "special_procedures": "",
+        "secret_data": secret_data,
+    }
+
+
+def _make():
+    index = SearchIndex()
+    return index, CatalogRetriever(index, top_k=3, token_budget=600, min_score=0.0)
+
+
+def _add(index, retriever, obj):
+    index.add(obj)
+    retriever.add(obj)
+
+
+def _remove(index, retriever, number):
+    index.remove(number)
+    retriever.remove(number)
+
+
+def test_create_update_delete():
+    index, retriever = _make()
+    _add(index, retriever, _object("0101", "Стеклянный сад", description="Оранжерея с поющими цветами"))
+
+    assert [doc["number"] for _, doc in index.search("цветы", 5)] == ["0101"]
+
+    _add(index, retriever, _object("0101", "Стеклянный сад", description="Зал с неподвижными часами"))
+    assert index.search("цветы", 5) == []
+    assert [doc["number"] for _, doc in index.search("часы", 5)] == ["0101"]
+    assert len(index) == 1
+
+    _remove(index, retriever, "0101")
+    assert len(index) == 0
+    assert index.search("часы", 5) == []
+    assert retriever.retrieve("часы", 5) == []
+    assert index.postings == {}
+
+
+def test_delete_unknown_object():
+    index, retriever = _make()
+    assert index.remove("9999") is False
+    retriever.remove("9999")
+
+
+def test_secret_data_only_at_clearance_five():
+    index, retriever = _make()
+    _add(index, retriever, _object("0102", "Тихий колокол", description="Колокол звучит беззвучно"))
+
+    for level in range(1, 5):
+        context = context_block(retriever.retrieve("колокол", level))
+        assert "Тихий колокол" in context
+        assert SECRET not in context
+
+    assert SECRET in context_block(retriever.retrieve("колокол", 5))
+    # secret_data is never searchable, at any level
+    assert index.search("тайника", 5) == []
+
+
+def test_objects_above_clearance_are_not_retrieved():
+    index, retriever = _make()
+    _add(index, retriever, _object("0103", "Чёрная башня", threat_class="Annihilation", description="Башня растёт ночью"))
+
+    assert retriever.retrieve("башня", 1) == []
+    assert retriever.retrieve("башня", 5)
+
+
+def test_token_budget():
+    index = SearchIndex()
+    retriever = CatalogRetriever(index, top_k=5, token_budget=60, min_score=0.0)
+    for i in range(5):
+        obj = _object(f"020{i}", f"Зеркало {i}", description="Зеркало показывает чужие сны " * 20)
+        _add(index, retriever, obj)
+
+    passages = retriever.retrieve("зеркало", 5)
+    assert passages
+    assert sum(estimate_tokens(passage) for passage in passages) <= 60
+
+
+def test_server_unindex_removes_object():
+    import server
+
+    obj = _object("0301", "Пустая клетка", description="Клетка всегда пуста")
+    server.index_scp_object(obj)
+    assert [doc["number"] for _, doc in server.search_index.search("клетка", 5)] == ["0301"]
+
+    server.unindex_scp_object("0301")
+    assert server.search_index.search("клетка", 5) == []
+    assert server.catalog_retriever.retrieve("клетка", 5) == []
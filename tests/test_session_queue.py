@@ -0,0 +1,76 @@
+"""
+Per-session serialization, coalescing and idempotency of chat turns.
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+BACKEND_DIR = str(Path(__file__).resolve().parent.parent / "backend")
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from session_queue import SessionQueue  # noqa: E402
+
+
+def test_turns_are_serialized_per_session():
+    async def run_test():
+        queue = SessionQueue()
+        events = []
+
+        def runner(tag):
+            async def run(messages):
+                events.append(("start", tag))
+                await asyncio.sleep(0.01)
+                events.append(("end", tag))
+                return messages
+            return run
+
+        results = await asyncio.gather(
+            queue.submit("s", "1", runner("a")),
+            queue.submit("s", "2", runner("b")),
+        )
+        assert results == [["1"], ["2"]]
+        assert events == [("start", "a"), ("end", "a"), ("start", "b"), ("end", "b")]
+        assert len(queue) == 0
+
+    asyncio.run(run_test())
+
+
+def test_coalescing_never_mixes_principals():
+    async def run_test():
+        queue = SessionQueue(coalesce_window=0.01)
+        batches = []
+
+        def runner(principal):
+            async def run(messages):
+                batches.append((principal, messages))
+                return principal
+            return run
+
+        submissions = [("u1", "a"), ("u1", "b"), ("u2", "c"), ("u1", "d")]
+        results = await asyncio.gather(*(
+            queue.submit("s", message, runner(principal), principal)
+            for principal, message in submissions
+        ))
+        assert results == ["u1", "u1", "u2", "u1"]
+        assert batches == [("u1", ["a", "b"]), ("u2", ["c"]), ("u1", ["d"])]
+
+    asyncio.run(run_test())
+
+
+def test_idempotent_retries_share_one_turn():
+    async def run_test():
+        queue = SessionQueue()
+        calls = []
+
+        async def turn():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return len(calls)
+
+        first, retry = await asyncio.gather(queue.once("key", turn), queue.once("key", turn))
+        assert (first, retry) == (1, 1)
+        assert await queue.once("key", turn) == 1
+        assert await queue.once(None, turn) == 2
+
+    asyncio.run(run_test())